@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+"""
+Headless HTTP API for the assistant, for driving summaries, Q&A and challenges from other systems.
+
+    python api_server.py --port 8080 --workers 8
+
+    curl -F file=@paper.pdf http://127.0.0.1:8080/documents
+    curl -d '{"document_id": "...", "question": "What was measured?"}' http://127.0.0.1:8080/ask
+    curl -F file=@paper.pdf 'http://127.0.0.1:8080/summarize?async=1'
+    curl http://127.0.0.1:8080/jobs/<job_id>
+
+Work runs on a bounded worker pool; when every worker is busy and the queue is full, requests
+are answered with 429 and a Retry-After header. Uses only the standard library and the app's
+modules, not Streamlit.
+"""
+
+import argparse
+import email.policy
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, parse_qsl
+from utils import open_document, generate_summary, ask_anything, extract_supporting_evidence
+from question_bank import draw_challenge
+from document_store import store as document_store
+from metrics import span, registry, export_prometheus
+
+API_WORKERS = int(os.getenv("API_WORKERS", "8"))
+# Jobs accepted beyond the running ones before new requests get 429
+API_QUEUE_SIZE = int(os.getenv("API_QUEUE_SIZE", "32"))
+# Seconds a request without ?async=1 waits for its result before getting a job id instead
+API_SYNC_TIMEOUT = float(os.getenv("API_SYNC_TIMEOUT", "60"))
+API_MAX_UPLOAD_BYTES = int(os.getenv("API_MAX_UPLOAD_MB", "50")) * 1024 * 1024
+API_MAX_JOBS = int(os.getenv("API_MAX_JOBS", "1000"))
+API_MAX_DOCUMENTS = int(os.getenv("API_MAX_DOCUMENTS", "64"))
+
+QUESTION_TYPES = ("mixed", "mcq", "open")
+FILE_TYPES = {".pdf": "application/pdf", ".txt": "text/plain"}
+
+
+class ApiError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+class Upload:
+    """A file from a multipart request, shaped like the Streamlit upload utils expects"""
+
+    def __init__(self, name, type, data):
+        self.name = name
+        self.type = type
+        self._data = data
+
+    def getvalue(self):
+        return self._data
+
+
+def parse_multipart(content_type, body):
+    """Split a multipart/form-data body into ({field: str}, {field: Upload})"""
+    message = BytesParser(policy=email.policy.HTTP).parsebytes(
+        b"Content-Type: " + content_type.encode("latin-1") + b"\r\n\r\n" + body)
+    if not message.is_multipart():
+        raise ApiError(400, "Malformed multipart body")
+
+    fields, files = {}, {}
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        if not name:
+            continue
+        data = part.get_payload(decode=True) or b""
+        filename = part.get_filename()
+        if filename is None:
+            fields[name] = data.decode(part.get_content_charset() or "utf-8")
+            continue
+        # Clients often send application/octet-stream or no type at all; then go by the extension
+        file_type = part.get_content_type() if part["Content-Type"] else None
+        if file_type not in FILE_TYPES.values():
+            file_type = FILE_TYPES.get(os.path.splitext(filename)[1].lower(), file_type or "application/octet-stream")
+        files[name] = Upload(filename, file_type, data)
+    return fields, files
+
+
+class Job:
+    def __init__(self, kind):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.http_status = 200
+        self.created = time.time()
+        self.finished = None
+        self.done = threading.Event()
+
+    def to_dict(self):
+        body = {"job_id": self.id, "kind": self.kind, "status": self.status}
+        if self.status == "done":
+            body["result"] = self.result
+        elif self.status == "failed":
+            body["error"] = self.error
+        return body
+
+
+class WorkerPool:
+    """
+    Thread pool with a bounded backlog: submit() returns None instead of queueing
+    once workers + queue_size jobs are pending. Recent jobs are kept for polling.
+    """
+
+    def __init__(self, workers=API_WORKERS, queue_size=API_QUEUE_SIZE, max_jobs=API_MAX_JOBS):
+        self.workers = workers
+        self.capacity = workers + queue_size
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="api")
+        self._slots = threading.BoundedSemaphore(self.capacity)
+        self._jobs = OrderedDict()
+        self._max_jobs = max_jobs
+        self._lock = threading.Lock()
+        self.pending = 0
+
+    def submit(self, kind, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            return None
+        job = Job(kind)
+        with self._lock:
+            self.pending += 1
+            self._jobs[job.id] = job
+            # Forget the oldest finished jobs; unfinished ones are always kept
+            for job_id in [i for i, j in self._jobs.items() if j.done.is_set()][:max(0, len(self._jobs) - self._max_jobs)]:
+                del self._jobs[job_id]
+        self._executor.submit(self._run, job, fn, args)
+        return job
+
+    def _run(self, job, fn, args):
+        job.status = "running"
+        try:
+            with span(f"api.{job.kind}"):
+                job.result = fn(*args)
+            job.status = "done"
+        except ApiError as e:
+            job.error = str(e)
+            job.http_status = e.status
+            job.status = "failed"
+        except Exception as e:
+            job.error = f"{type(e).__name__}: {e}"
+            job.http_status = 500
+            job.status = "failed"
+        finally:
+            job.finished = time.time()
+            job.done.set()
+            with self._lock:
+                self.pending -= 1
+            self._slots.release()
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            return {"workers": self.workers, "capacity": self.capacity, "pending": self.pending,
+                    "jobs": len(self._jobs)}
+
+
+class Documents:
+    """
+    Documents uploaded through the API, by document_id (their content hash). Holds a
+    document store handle for the most recent max_documents, releasing older ones.
+    """
+
+    def __init__(self, max_documents=API_MAX_DOCUMENTS):
+        self.max_documents = max_documents
+        self._handles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, upload):
+        if upload.type not in FILE_TYPES.values():
+            raise ApiError(415, "Unsupported file type. Please upload PDF or TXT files.")
+        try:
+            handle = open_document(upload)
+        except Exception as e:
+            raise ApiError(422, f"Error extracting text: {e}")
+        with self._lock:
+            previous = self._handles.pop(handle.doc_key, None)
+            self._handles[handle.doc_key] = handle
+            while len(self._handles) > self.max_documents:
+                self._handles.popitem(last=False)[1].release()
+        if previous is not None:
+            previous.release()
+        return handle
+
+    def get(self, document_id):
+        with self._lock:
+            handle = self._handles.get(document_id)
+            if handle is not None:
+                self._handles.move_to_end(document_id)
+                return handle
+        raise ApiError(404, f"Unknown document_id {document_id!r}; upload the file again")
+
+
+def _describe(handle):
+    return {"document_id": handle.doc_key, "characters": len(handle), "pages": len(handle.page_offsets or [None])}
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "SmartAssistantAPI/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, data, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+        registry.inc("api_requests_total", endpoint=self._endpoint, status=status)
+
+    def _send_json(self, status, body, headers=None):
+        self._send(status, json.dumps(body).encode("utf-8"), "application/json", headers)
+
+    def _dispatch(self, routes):
+        url = urlsplit(self.path)
+        self._endpoint = url.path if url.path in routes else "/jobs" if url.path.startswith("/jobs/") else "other"
+        try:
+            handler = routes.get(url.path)
+            if handler is None and url.path.startswith("/jobs/") and self.command == "GET":
+                handler = self._job
+            if handler is None:
+                raise ApiError(404, "Not found")
+            handler(url.path, parse_qs(url.query))
+        except ApiError as e:
+            self._send_json(e.status, {"error": str(e)}, e.headers)
+        except Exception as e:
+            self._send_json(500, {"error": f"{type(e).__name__}: {e}"})
+
+    def do_GET(self):
+        self._dispatch({"/health": self._health, "/metrics": self._metrics})
+
+    def do_POST(self):
+        self._dispatch({"/documents": self._documents, "/summarize": self._summarize,
+                        "/ask": self._ask, "/challenge": self._challenge})
+
+    def _health(self, path, query):
+        self._send_json(200, {"status": "ok", "pool": self.server.pool.stats(),
+                              "documents": document_store.stats()})
+
+    def _metrics(self, path, query):
+        self._send(200, export_prometheus().encode("utf-8"), "text/plain; version=0.0.4")
+
+    def _job(self, path, query):
+        job = self.server.pool.get(path[len("/jobs/"):])
+        if job is None:
+            raise ApiError(404, "Unknown or expired job")
+        self._send_json(200, job.to_dict())
+
+    def _read_request(self):
+        """Return (fields, upload or None) from a JSON, form or multipart/form-data body"""
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > API_MAX_UPLOAD_BYTES:
+            self.close_connection = True  # The body is not read
+            raise ApiError(413, f"Request body over {API_MAX_UPLOAD_BYTES // (1024 * 1024)} MB")
+        body = self.rfile.read(length)
+        content_type = self.headers.get("Content-Type", "")
+        if content_type.startswith("multipart/form-data"):
+            fields, files = parse_multipart(content_type, body)
+            return fields, files.get("file")
+        if content_type.startswith("application/x-www-form-urlencoded"):
+            return dict(parse_qsl(body.decode("utf-8"))), None
+        try:
+            fields = json.loads(body or b"{}")
+        except ValueError:
+            raise ApiError(400, "Body must be JSON, form or multipart/form-data")
+        if not isinstance(fields, dict):
+            raise ApiError(400, "JSON body must be an object")
+        return fields, None
+
+    def _run(self, kind, query, fn, *args):
+        """Queue fn on the worker pool and answer with its result, or with a job id for ?async=1 and slow jobs"""
+        job = self.server.pool.submit(kind, fn, *args)
+        if job is None:
+            raise ApiError(429, "Server busy, retry later", {"Retry-After": "1"})
+        if query.get("async", ["0"])[0] not in ("1", "true") and job.done.wait(self.server.sync_timeout):
+            self._send_json(job.http_status, job.to_dict())
+            return
+        self._send_json(202, job.to_dict(), {"Location": f"/jobs/{job.id}"})
+
+    def _check_document(self, fields, upload):
+        """Fail fast, before queueing a job, when the request names no document or an unknown one"""
+        if upload is None:
+            if not fields.get("document_id"):
+                raise ApiError(400, "Send a file or a document_id")
+            self.server.documents.get(fields["document_id"])
+
+    def _document(self, fields, upload):
+        """The handle for the request's uploaded file or its document_id (called on a worker)"""
+        if upload is not None:
+            return self.server.documents.add(upload)
+        return self.server.documents.get(fields["document_id"])
+
+    def _documents(self, path, query):
+        fields, upload = self._read_request()
+        if upload is None:
+            raise ApiError(400, "Send the document as the multipart field 'file'")
+        self._run("extract", query, lambda: _describe(self.server.documents.add(upload)))
+
+    def _summarize(self, path, query):
+        fields, upload = self._read_request()
+        self._check_document(fields, upload)
+
+        def summarize():
+            handle = self._document(fields, upload)
+            summary = handle.artifact("summary")
+            if not summary:
+                summary = generate_summary(handle.text)
+                if summary.startswith("Error:"):
+                    raise ApiError(502, summary)
+                handle.set_artifact("summary", summary)
+            return dict(_describe(handle), summary=summary)
+        self._run("summarize", query, summarize)
+
+    def _ask(self, path, query):
+        fields, upload = self._read_request()
+        question = (fields.get("question") or "").strip()
+        if not question:
+            raise ApiError(400, "Missing question")
+        self._check_document(fields, upload)
+
+        def ask():
+            handle = self._document(fields, upload)
+            text, page_offsets = document_store.document(handle.doc_key)
+            # Streamed and joined, like the app, so evidence is located once and with page numbers
+            answer = "".join(ask_anything(text, question, stream=True))
+            if answer.startswith("Error:"):
+                raise ApiError(502, answer)
+            return dict(_describe(handle), answer=answer,
+                        evidence=extract_supporting_evidence(answer, text, page_offsets))
+        self._run("ask", query, ask)
+
+    def _challenge(self, path, query):
+        fields, upload = self._read_request()
+        question_type = fields.get("question_type") or "mixed"
+        if question_type not in QUESTION_TYPES:
+            raise ApiError(400, f"question_type must be one of {', '.join(QUESTION_TYPES)}")
+        self._check_document(fields, upload)
+
+        def challenge():
+            handle = self._document(fields, upload)
+            return dict(_describe(handle), questions=draw_challenge(handle.doc_key, handle.text, question_type))
+        self._run("challenge", query, challenge)
+
+
+def make_server(host="127.0.0.1", port=8080, workers=API_WORKERS, queue_size=API_QUEUE_SIZE,
+                sync_timeout=API_SYNC_TIMEOUT):
+    server = ThreadingHTTPServer((host, port), ApiHandler)
+    server.daemon_threads = True
+    server.pool = WorkerPool(workers, queue_size)
+    server.documents = Documents()
+    server.sync_timeout = sync_timeout
+    return server
+
+
+def start_server(host="127.0.0.1", port=0, **options):
+    """Start the API on a background thread. Returns (server, base_url); call server.shutdown() to stop."""
+    server = make_server(host, port, **options)
+    threading.Thread(target=server.serve_forever, name="api-server", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve summaries, Q&A and challenges over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=API_WORKERS, help="Jobs run concurrently")
+    parser.add_argument("--queue", type=int, default=API_QUEUE_SIZE, help="Jobs waiting before 429")
+    parser.add_argument("--sync-timeout", type=float, default=API_SYNC_TIMEOUT,
+                        help="Seconds to wait for a result before answering with a job id")
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.workers, args.queue, args.sync_timeout)
+    print(f"Smart Assistant API at http://{args.host}:{args.port} (health at /health, metrics at /metrics)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
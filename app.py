@@ -1,18 +1,35 @@
 # app.py
 
 import streamlit as st
-from utils import extract_text, generate_summary, ask_anything, challenge_me
-from groq_api import groq_chat, test_groq_connection
+from streamlit.errors import StreamlitAPIException
+from utils import (open_document, generate_summary, ask_anything, extract_supporting_evidence,
+                   get_extraction_cache_stats)
+from groq_api import (test_groq_connection, get_model_health, get_rate_limiter_stats,
+                      get_response_cache_stats, get_connection_stats)
+from grading import grade_open_answers, grade_key, format_grade
+from precompute import open_pipeline
+from question_bank import draw_challenge
+from document_store import store as document_store
+from conversation import ConversationMemory
+from chat_view import WINDOW_MESSAGES, message_html, window_html
+from json_repair import get_parse_stats
+from metrics import span, export_prometheus, recent_traces, format_trace, llm_summary
 
 st.set_page_config(page_title="Smart Assistant", layout="wide")
 
 # Initialize session state for chat history
 if "chat_history" not in st.session_state:
     st.session_state.chat_history = []
-if "document_text" not in st.session_state:
-    st.session_state.document_text = ""
+if "conversation" not in st.session_state:
+    # What the model is told about earlier turns: recent ones verbatim, older ones summarized
+    st.session_state.conversation = ConversationMemory()
+if "document" not in st.session_state:
+    # Handle on the shared document store; the text itself is held once per process
+    st.session_state.document = None
 if "input_key" not in st.session_state:
     st.session_state.input_key = 0
+if "seen_question_ids" not in st.session_state:
+    st.session_state.seen_question_ids = set()
 
 st.title("🧠 Smart Assistant for Research Summarization")
 
@@ -72,17 +89,119 @@ else:
     st.sidebar.error("🔴 API Connection: Issues detected")
     st.sidebar.info("💡 The app may work with limited functionality")
 
+def rerun_chat():
+    """Rerun just the chat fragment; falls back to a full rerun when the app itself is rerunning"""
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
+
+@st.fragment
+def chat_view(pipeline):
+    """
+    The Ask Anything chat. As a fragment it reruns on its own when a question is sent,
+    and it renders only a window of recent messages from HTML cached on each message,
+    so a rerun costs about the same after hundreds of turns as after one.
+    """
+    history = st.session_state.chat_history
+    if "chat_visible" not in st.session_state:
+        st.session_state.chat_visible = WINDOW_MESSAGES
+    
+    # Display chat history
+    chat_html, hidden = window_html(history, st.session_state.chat_visible)
+    if hidden and st.button(f"⬆️ Show earlier messages ({hidden} hidden)", key="chat_show_earlier"):
+        st.session_state.chat_visible += WINDOW_MESSAGES
+        rerun_chat()
+    if chat_html:
+        st.markdown(chat_html, unsafe_allow_html=True)
+    
+    # Chat input with Enter key support using form
+    with st.form(key=f"chat_form_{st.session_state.input_key}", clear_on_submit=True):
+        col1, col2 = st.columns([4, 1])
+        with col1:
+            user_question = st.text_input(
+                "Ask a question about the document:", 
+                placeholder="Type your question here and press Enter or click Send...",
+                key=f"question_input_{st.session_state.input_key}"
+            )
+        with col2:
+            send_button = st.form_submit_button("Send")
+    
+    # Clear chat button
+    if st.button("🗑️ Clear Chat"):
+        st.session_state.chat_history = []
+        st.session_state.chat_visible = WINDOW_MESSAGES
+        st.session_state.conversation.clear()
+        st.session_state.input_key += 1  # Reset input field
+        rerun_chat()
+    
+    # Process new message (works with both Enter key and Send button)
+    if send_button and user_question.strip():
+        # Add user message to history
+        user_message = {"role": "user", "content": user_question}
+        history.append(user_message)
+        st.markdown(message_html(user_message), unsafe_allow_html=True)
+        
+        with span("action.ask"):
+            # Reuse the retrieval index being built in the background rather than building it twice
+            if pipeline.claim("index") is not None:
+                pipeline.result("index")
+            
+            # Stream the AI response as it is generated
+            document = st.session_state.document
+            tokens = ask_anything(document.text, user_question, stream=True,
+                                  memory=st.session_state.conversation)
+            response = st.write_stream(tokens)
+            supporting_snippets = extract_supporting_evidence(response, document.text, document.page_offsets)
+        
+        # Add AI response to history, rendering its HTML now so later reruns only reuse it
+        assistant_message = {
+            "role": "assistant", 
+            "content": response,
+            "supporting_snippets": supporting_snippets
+        }
+        message_html(assistant_message)
+        history.append(assistant_message)
+        
+        # Clear the input by incrementing the key
+        st.session_state.input_key += 1
+        rerun_chat()
+
 uploaded_file = st.sidebar.file_uploader("Upload a PDF or TXT file", type=["pdf", "txt"])
 
 if uploaded_file:
-    # Text extraction
-    raw_text = extract_text(uploaded_file)
-    st.session_state.document_text = raw_text
+    # Text extraction, shared with every session that uploaded the same file; reruns reuse the handle
+    if st.session_state.get("upload_id") != uploaded_file.file_id or st.session_state.document is None:
+        try:
+            document = open_document(uploaded_file)
+        except Exception as e:
+            document = document_store.add_and_open(f"Error extracting text: {str(e)}")
+        if st.session_state.document is not None:
+            st.session_state.document.release()
+        st.session_state.document = document
+        st.session_state.upload_id = uploaded_file.file_id
+    # The text is read from the store only by the actions that need it, so reruns stay cheap
+    # even when a large document has been spilled to disk
+    document = st.session_state.document
     st.success("✅ Document uploaded and text extracted successfully!")
 
+    # Start building the retrieval and evidence indexes (and a summary, if quota is spare) in the background.
+    # Pipelines are shared by sessions on the same document; releasing the one this document
+    # replaces cancels its work only if no other session holds it
+    doc_key = document.doc_key
+    if st.session_state.get("doc_key") != doc_key:
+        st.session_state.doc_key = doc_key
+        st.session_state.conversation.clear()
+        st.session_state.seen_question_ids = set()
+    pipeline = st.session_state.get("pipeline")
+    if pipeline is None or pipeline.doc_key != doc_key or pipeline.cancelled:
+        if pipeline is not None:
+            pipeline.release()
+        pipeline = st.session_state.pipeline = open_pipeline(doc_key, document.text, document.page_offsets)
+
     # Document preview in sidebar
     with st.sidebar.expander("📖 Document Preview"):
-        preview_text = raw_text[:500] + "..." if len(raw_text) > 500 else raw_text
+        preview_text = document.slice(0, 500) + "..." if len(document) > 500 else document.slice(0, 500)
         st.text_area("Document content:", preview_text, height=150, disabled=True)
     
     st.sidebar.markdown("### 🤖 Choose a Mode")
@@ -91,78 +210,28 @@ if uploaded_file:
     # Summary
     if mode == "Summary":
         st.subheader("📑 Document Summary")
-        summary = generate_summary(raw_text)
-        st.text_area("Generated Summary (≤150 words):", summary, height=200)
+        st.markdown("**Generated Summary (≤150 words):**")
+        with st.container(border=True):
+            # Use a summary another session already produced or the background one if it is
+            # running; otherwise stream it now
+            summary = document.artifact("summary")
+            if not summary and pipeline.claim("summary") is not None:
+                with st.spinner("📑 Finishing summary..."):
+                    summary = pipeline.result("summary")
+            # A failed background summary is not shown; it is generated again below
+            if summary and not summary.startswith("Error:"):
+                st.write(summary)
+            else:
+                # Render tokens as they arrive; repeat visits are served from the response cache
+                with span("action.summary"):
+                    summary = st.write_stream(generate_summary(document.text, stream=True))
+                if isinstance(summary, str) and summary and not summary.startswith("Error:"):
+                    document.set_artifact("summary", summary)
 
     # Ask Anything - Chat Interface
     elif mode == "Ask Anything":
         st.subheader("💬 Chat About the Document")
-        
-        # Display chat history
-        chat_container = st.container()
-        with chat_container:
-            for i, message in enumerate(st.session_state.chat_history):
-                if message["role"] == "user":
-                    st.markdown(f"""
-                    <div style="background-color: #2b313e; padding: 10px; border-radius: 10px; margin: 5px 0; margin-left: 20%;">
-                        <strong>You:</strong> {message["content"]}
-                    </div>
-                    """, unsafe_allow_html=True)
-                else:
-                    st.markdown(f"""
-                    <div style="background-color: #1e1e1e; padding: 10px; border-radius: 10px; margin: 5px 0; margin-right: 20%;">
-                        <strong>🤖 Assistant:</strong> {message["content"]}
-                    </div>
-                    """, unsafe_allow_html=True)
-                    
-                    # Show supporting snippets if available
-                    if "supporting_snippets" in message and message["supporting_snippets"]:
-                        with st.expander("📄 Supporting Evidence from Document"):
-                            for i, snippet in enumerate(message["supporting_snippets"], 1):
-                                st.markdown(f"""
-                                <div style="background-color: #2d2d2d; padding: 8px; border-left: 3px solid #4CAF50; margin: 5px 0;">
-                                    <strong>Evidence {i}:</strong><br>
-                                    <em>"{snippet}"</em>
-                                </div>
-                                """, unsafe_allow_html=True)
-        
-        # Chat input with Enter key support using form
-        with st.form(key=f"chat_form_{st.session_state.input_key}", clear_on_submit=True):
-            col1, col2 = st.columns([4, 1])
-            with col1:
-                user_question = st.text_input(
-                    "Ask a question about the document:", 
-                    placeholder="Type your question here and press Enter or click Send...",
-                    key=f"question_input_{st.session_state.input_key}"
-                )
-            with col2:
-                send_button = st.form_submit_button("Send")
-        
-        # Clear chat button
-        if st.button("🗑️ Clear Chat"):
-            st.session_state.chat_history = []
-            st.session_state.input_key += 1  # Reset input field
-            st.rerun()
-        
-        # Process new message (works with both Enter key and Send button)
-        if send_button and user_question.strip():
-            # Add user message to history
-            st.session_state.chat_history.append({"role": "user", "content": user_question})
-            
-            # Get AI response
-            with st.spinner("🤖 Thinking..."):
-                response, supporting_snippets = ask_anything(st.session_state.document_text, user_question)
-            
-            # Add AI response to history
-            st.session_state.chat_history.append({
-                "role": "assistant", 
-                "content": response,
-                "supporting_snippets": supporting_snippets
-            })
-            
-            # Clear the input by incrementing the key
-            st.session_state.input_key += 1
-            st.rerun()
+        chat_view(pipeline)
 
     # Challenge Me
     elif mode == "Challenge Me":
@@ -186,8 +255,12 @@ if uploaded_file:
                 }
                 selected_type = type_mapping[question_type]
                 
-                # Generate questions and store in session state
-                st.session_state.challenge_questions = challenge_me(st.session_state.document_text, selected_type)
+                # Draw from the document's question bank, filling it for this type on first use
+                with st.spinner("🧠 Preparing questions..."), span("action.challenge", question_type=selected_type):
+                    questions = draw_challenge(doc_key, document.text, selected_type,
+                                               seen_ids=st.session_state.seen_question_ids)
+                st.session_state.seen_question_ids.update(q["bank_id"] for q in questions if "bank_id" in q)
+                st.session_state.challenge_questions = questions
                 st.session_state.challenge_answers = {}
                 st.session_state.challenge_feedback = {}
                 st.rerun()
@@ -236,36 +309,35 @@ if uploaded_file:
                     )
                     
                     if user_answer and st.button(f"📝 Evaluate Q{idx}", key=f"eval_{idx}"):
-                        with st.spinner("🤖 Evaluating your answer..."):
-                            eval_prompt = f"""
-                            Evaluate this answer for the given question. Provide a score out of 10 and detailed feedback.
-                            
-                            Question: {q['question']}
-                            Student Answer: {user_answer}
-                            
-                            Please provide:
-                            1. Score out of 10
-                            2. What was good about the answer
-                            3. What could be improved
-                            4. Key points that were missed (if any)
-                            
-                            Format: Score: X/10
-                            Feedback: [detailed feedback]
-                            """
-                            
-                            eval_response = groq_chat(eval_prompt, temperature=0.3, max_tokens=300)
-                            st.session_state.challenge_feedback[f"q{idx}"] = eval_response
+                        with st.spinner("🤖 Evaluating your answer..."), span("action.grade", answers=1):
+                            grade = grade_open_answers([(q['question'], user_answer)])[0]
+                            st.session_state.challenge_feedback[grade_key(q['question'], user_answer)] = grade
                             st.rerun()
                     
-                    # Display feedback if available
-                    if f"q{idx}" in st.session_state.challenge_feedback:
+                    # Display feedback if available (keyed by question and answer, so edits need re-evaluation)
+                    feedback = st.session_state.challenge_feedback.get(grade_key(q['question'], user_answer)) if user_answer else None
+                    if feedback:
                         st.markdown("**🤖 AI Evaluation:**")
-                        st.write(st.session_state.challenge_feedback[f"q{idx}"])
+                        st.write(format_grade(feedback))
+                        total_score += feedback.get("score") or 0
                         max_score += 10
                 
                 st.markdown("---")
             
-            # Show overall score for MCQ questions
+            # Grade every written answer in a single request
+            open_answers = [
+                (q['question'], st.session_state.get(f"open_{idx}", ""))
+                for idx, q in enumerate(st.session_state.challenge_questions, 1)
+                if q.get('type') != 'mcq'
+            ]
+            open_answers = [(question, answer) for question, answer in open_answers if answer and answer.strip()]
+            if len(open_answers) > 1 and st.button("📝 Evaluate All Answers", key="eval_all"):
+                with st.spinner("🤖 Evaluating your answers..."), span("action.grade", answers=len(open_answers)):
+                    for (question, answer), grade in zip(open_answers, grade_open_answers(open_answers)):
+                        st.session_state.challenge_feedback[grade_key(question, answer)] = grade
+                st.rerun()
+            
+            # Show overall score
             if max_score > 0:
                 score_percentage = (total_score / max_score) * 100
                 st.markdown(f"### 📊 Current Score: {total_score}/{max_score} ({score_percentage:.1f}%)")
@@ -299,3 +371,26 @@ else:
     
     The assistant will analyze your document and provide intelligent responses based on the content.
     """)
+
+# Optional diagnostics: where time went in recent actions, LLM call figures and Prometheus metrics
+if st.sidebar.checkbox("🩺 Show diagnostics", key="show_diagnostics"):
+    with st.sidebar.expander("🩺 Diagnostics", expanded=True):
+        st.markdown("**LLM calls**")
+        st.json(llm_summary())
+        st.markdown("**Recent actions**")
+        traces = recent_traces(limit=10)
+        if traces:
+            st.code("\n\n".join(format_trace(trace) for trace in traces), language=None)
+        else:
+            st.caption("No traced actions yet.")
+        st.markdown("**Models**")
+        st.json(get_model_health(), expanded=False)
+        st.markdown("**Rate limiter**")
+        st.json(get_rate_limiter_stats(), expanded=False)
+        st.markdown("**JSON parsing**")
+        st.json(get_parse_stats(), expanded=False)
+        st.markdown("**Caches and connections**")
+        st.json({"responses": get_response_cache_stats(), "extraction": get_extraction_cache_stats(),
+                 "connections": get_connection_stats(), "documents": document_store.stats()}, expanded=False)
+        st.download_button("⬇️ Prometheus metrics", export_prometheus(), file_name="metrics.prom",
+                           mime="text/plain")
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Batch summaries and challenge questions for a directory of PDF/TXT documents.
+
+    python batch.py papers/ -o results.jsonl
+    python batch.py papers/ -o results.jsonl --extract-workers 8 --concurrency 4 --question-type mcq
+
+Each document is written to the JSONL output as soon as it is finished and recorded in a
+checkpoint file (results.jsonl.checkpoint). Rerunning the same command after an interruption
+skips documents already done; --retry-errors also redoes the ones that failed. A document that
+is reprocessed gets a new line, so readers should keep the last record per "path".
+
+Text extraction runs on a process pool; LLM work runs on --concurrency threads.
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pdf_extract
+from utils import extract_document, generate_summary, challenge_me
+
+FILE_TYPES = {".pdf": "application/pdf", ".txt": "text/plain"}
+REPORT_INTERVAL = 1.0
+
+
+class FileUpload:
+    """A file on disk, shaped like the Streamlit upload extract_document expects"""
+
+    def __init__(self, path):
+        self.name = os.path.basename(path)
+        self.type = FILE_TYPES[os.path.splitext(path)[1].lower()]
+        self.path = path  # Large files are extracted in place rather than read into memory
+
+    def getvalue(self):
+        with open(self.path, "rb") as f:
+            return f.read()
+
+
+def _init_extract_worker():
+    # Documents are already extracted in parallel; one document must not fan out to another pool
+    pdf_extract.MAX_WORKERS = 1
+
+
+def _extract_file(path):
+    """Extract one file in a pool worker; returns (text, page_count)"""
+    document = extract_document(FileUpload(path))
+    return document.text, document.page_count
+
+
+def find_documents(directory, recursive=False):
+    """Paths of the PDF and TXT files under directory, sorted"""
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        paths.extend(os.path.join(root, name) for name in files if os.path.splitext(name)[1].lower() in FILE_TYPES)
+        if not recursive:
+            break
+        dirs.sort()
+    return sorted(paths)
+
+
+def document_key(path, directory):
+    """Identifies a document version: a file that is modified or replaced is processed again"""
+    stat = os.stat(path)
+    return f"{os.path.relpath(path, directory)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+class Checkpoint:
+    """
+    Completed documents (key -> status) of a run, appended to a file as they finish, together
+    with the JSONL output. Loading repairs a run killed mid-write: a torn last output line is
+    cut off, and records written to the output but not yet to the checkpoint are adopted.
+    """
+
+    def __init__(self, output_path, checkpoint_path):
+        self.done = {}
+        self._lock = threading.Lock()
+
+        if os.path.exists(checkpoint_path):
+            with open(checkpoint_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Torn last line
+                    self.done[entry["key"]] = entry["status"]
+
+        if os.path.exists(output_path):
+            self._truncate_torn_line(output_path)
+            with open(output_path, encoding="utf-8") as f:
+                adopted = [record for record in map(json.loads, f) if "key" in record and record["key"] not in self.done]
+        else:
+            adopted = []
+
+        self._output = open(output_path, "a", encoding="utf-8")
+        self._checkpoint = open(checkpoint_path, "a", encoding="utf-8")
+        for record in adopted:
+            self._mark(record)
+        self._checkpoint.flush()
+
+    @staticmethod
+    def _truncate_torn_line(path):
+        with open(path, "rb+") as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+
+    def _mark(self, record):
+        self.done[record["key"]] = record["status"]
+        self._checkpoint.write(json.dumps({"key": record["key"], "status": record["status"]}) + "\n")
+
+    def write(self, record):
+        """Append a finished document's record, then mark it done"""
+        with self._lock:
+            self._output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._output.flush()
+            self._mark(record)
+            self._checkpoint.flush()
+
+    def close(self):
+        self._output.close()
+        self._checkpoint.close()
+
+
+class Progress:
+    """Documents finished, throughput and ETA, redrawn in place on a terminal"""
+
+    def __init__(self, total, stream=sys.stderr):
+        self.total = total
+        self.done = 0
+        self.errors = 0
+        self.stream = stream
+        self.started = time.monotonic()
+        self._last_report = 0.0
+        self._lock = threading.Lock()
+
+    def update(self, status):
+        with self._lock:
+            self.done += 1
+            if status != "ok":
+                self.errors += 1
+            self.report()
+
+    def line(self):
+        elapsed = time.monotonic() - self.started
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        remaining = (self.total - self.done) / rate if rate > 0 else None
+        eta = time.strftime("%H:%M:%S", time.gmtime(remaining)) if remaining is not None else "--:--:--"
+        return (f"{self.done}/{self.total} documents, {self.errors} errors, "
+                f"{rate * 60:.1f} docs/min, elapsed {time.strftime('%H:%M:%S', time.gmtime(elapsed))}, ETA {eta}")
+
+    def report(self):
+        now = time.monotonic()
+        interactive = self.stream.isatty()
+        # Redraw often on a terminal; log a line every 30 s when redirected to a file
+        if now - self._last_report < (REPORT_INTERVAL if interactive else 30.0):
+            return
+        self._last_report = now
+        self.stream.write(("\r" + self.line() + "\033[K") if interactive else self.line() + "\n")
+        self.stream.flush()
+
+
+def process_document(path, key, directory, text, page_count, question_type, summary=True, questions=True):
+    """Summary and questions for one extracted document, as an output record"""
+    started = time.monotonic()
+    record = {"path": os.path.relpath(path, directory), "key": key, "status": "ok",
+              "characters": len(text), "pages": page_count}
+    if summary:
+        # One call at a time per document, so --concurrency bounds the calls in flight
+        record["summary"] = generate_summary(text, parallelism=1)
+        if record["summary"].startswith("Error:"):
+            record["status"] = "error"
+            record["error"] = record.pop("summary")
+    if questions and record["status"] == "ok":
+        record["questions"] = challenge_me(text, question_type)
+    record["seconds"] = round(time.monotonic() - started, 3)
+    return record
+
+
+def _extraction_pool(workers):
+    if workers <= 0:
+        return ThreadPoolExecutor(max_workers=1)
+    try:
+        return ProcessPoolExecutor(max_workers=workers, initializer=_init_extract_worker)
+    except (OSError, NotImplementedError):
+        # Process pools are unavailable on some hosts; extract in-process
+        return ThreadPoolExecutor(max_workers=1)
+
+
+def run(directory, output, checkpoint_path=None, extract_workers=None, concurrency=4, question_type="mixed",
+        summary=True, questions=True, recursive=False, retry_errors=False, limit=None):
+    """Process every unfinished document under directory. Returns the Progress of the run."""
+    checkpoint = Checkpoint(output, checkpoint_path or f"{output}.checkpoint")
+    if extract_workers is None:
+        extract_workers = os.cpu_count() or 1
+
+    pending = []
+    for path in find_documents(directory, recursive):
+        key = document_key(path, directory)
+        status = checkpoint.done.get(key)
+        if status == "ok" or (status is not None and not retry_errors):
+            continue
+        pending.append((path, key))
+    if limit:
+        pending = pending[:limit]
+
+    progress = Progress(len(pending))
+    if not pending:
+        checkpoint.close()
+        return progress
+
+    extraction = _extraction_pool(extract_workers)
+    llm = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch")
+    # Extracted texts waiting for the LLM stage are held in memory, so keep the queue short
+    ahead = threading.BoundedSemaphore(max(extract_workers, 1) + concurrency * 2)
+    finished = threading.Event()
+
+    def finish(record):
+        checkpoint.write(record)
+        progress.update(record["status"])
+        ahead.release()
+        if progress.done == progress.total:
+            finished.set()
+
+    def error_record(path, key, error):
+        return {"path": os.path.relpath(path, directory), "key": key, "status": "error", "error": error}
+
+    def llm_stage(path, key, text, page_count):
+        try:
+            record = process_document(path, key, directory, text, page_count, question_type, summary, questions)
+        except Exception as e:
+            record = error_record(path, key, f"{type(e).__name__}: {e}")
+        finish(record)
+
+    def extracted(future, path, key):
+        # Runs as soon as the extraction finishes, handing the text straight to the LLM stage
+        try:
+            text, page_count = future.result()
+        except Exception as e:
+            finish(error_record(path, key, f"Error extracting text: {e}"))
+            return
+        llm.submit(llm_stage, path, key, text, page_count)
+
+    try:
+        for path, key in pending:
+            while not ahead.acquire(timeout=REPORT_INTERVAL):
+                progress.report()
+            future = extraction.submit(_extract_file, path)
+            future.add_done_callback(lambda future, path=path, key=key: extracted(future, path, key))
+        while not finished.wait(REPORT_INTERVAL):
+            progress.report()
+    finally:
+        extraction.shutdown(wait=False, cancel_futures=True)
+        llm.shutdown(wait=True, cancel_futures=True)
+        checkpoint.close()
+    if progress.stream.isatty():
+        progress.stream.write("\n")  # Keep the last redrawn line
+    return progress
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize and generate questions for a directory of documents")
+    parser.add_argument("directory", help="Directory of PDF/TXT files")
+    parser.add_argument("-o", "--output", default="results.jsonl", help="JSONL file results are appended to")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: OUTPUT.checkpoint)")
+    parser.add_argument("--extract-workers", type=int, default=None,
+                        help="Extraction processes (default: CPU count, 0: in-process)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Documents in the LLM stage at once")
+    parser.add_argument("--question-type", choices=["mixed", "mcq", "open"], default="mixed")
+    parser.add_argument("--no-summary", action="store_true")
+    parser.add_argument("--no-questions", action="store_true")
+    parser.add_argument("-r", "--recursive", action="store_true", help="Include subdirectories")
+    parser.add_argument("--retry-errors", action="store_true", help="Redo documents that failed in earlier runs")
+    parser.add_argument("--limit", type=int, default=None, help="Process at most this many documents")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.directory):
+        parser.error(f"{args.directory} is not a directory")
+    try:
+        progress = run(args.directory, args.output, args.checkpoint, args.extract_workers, args.concurrency,
+                       args.question_type, not args.no_summary, not args.no_questions, args.recursive,
+                       args.retry_errors, args.limit)
+    except KeyboardInterrupt:
+        # Documents in the LLM stage were finished and checkpointed before exiting
+        print("\nInterrupted; run the same command again to resume.", file=sys.stderr)
+        sys.exit(130)
+    print(f"Done: {progress.line()}")
+    sys.exit(1 if progress.errors else 0)
+
+
+if __name__ == "__main__":
+    main()
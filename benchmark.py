@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmarks against the local mock Groq server (mock_groq.py).
+
+    python benchmark.py                      # run all cases, print p50/p95/p99 and throughput
+    python benchmark.py --save-baseline      # store the results as the regression baseline
+    python benchmark.py --compare            # compare against the baseline, exit 1 on regression
+
+Inputs are fresh per iteration so every run measures the uncached path; --warm reuses them
+to measure cache hits instead. Baselines are machine-specific: record them on the machine
+that runs the comparison.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from mock_groq import MockConfig, start_server
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+_VOCABULARY = (
+    "photosynthesis chlorophyll membrane protein enzyme catalyst reaction gradient energy transport "
+    "analysis method sample result hypothesis experiment control variable measurement average "
+    "increase decrease temperature pressure volume density concentration solution network model "
+    "training dataset accuracy evaluation baseline system architecture memory latency throughput"
+).split()
+
+
+class Upload:
+    """Minimal stand-in for a Streamlit UploadedFile"""
+
+    def __init__(self, data, file_type, name):
+        self.data = data
+        self.type = file_type
+        self.name = name
+
+    def getvalue(self):
+        return self.data
+
+
+def synthetic_text(chars, seed):
+    rng = random.Random(seed)
+    sentences = []
+    total = 0
+    while total < chars:
+        words = rng.choices(_VOCABULARY, k=rng.randint(8, 20))
+        sentence = " ".join(words).capitalize() + f" was measured at {rng.randint(1, 999)} units."
+        sentences.append(sentence)
+        total += len(sentence) + 1
+    return " ".join(sentences)
+
+
+def synthetic_pdf(pages, seed):
+    import fitz
+
+    doc = fitz.open()
+    for page_number in range(pages):
+        page = doc.new_page()
+        page.insert_textbox(fitz.Rect(50, 50, 550, 800), synthetic_text(2500, f"{seed}-{page_number}"), fontsize=9)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, min(len(sorted_values), round(p / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[rank - 1]
+
+
+def run_case(fn, inputs, concurrency):
+    """Call fn once per input; returns latencies (seconds) and total wall time"""
+    def timed(arg):
+        start = time.perf_counter()
+        fn(arg)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            latencies = list(executor.map(timed, inputs))
+    else:
+        latencies = [timed(arg) for arg in inputs]
+    return latencies, time.perf_counter() - start
+
+
+def summarize(latencies, wall):
+    ordered = sorted(latencies)
+    return {
+        "iterations": len(ordered),
+        "throughput": round(len(ordered) / wall, 3) if wall else None,
+        "mean": round(sum(ordered) / len(ordered), 4),
+        "p50": round(percentile(ordered, 50), 4),
+        "p95": round(percentile(ordered, 95), 4),
+        "p99": round(percentile(ordered, 99), 4),
+    }
+
+
+def build_cases(args):
+    """Return {name: (fn, inputs)}; imports the app modules after the environment points at the mock"""
+    import utils
+    from grading import grade_open_answers
+
+    n = args.iterations
+    variants = (lambda make: [make(0)] * n) if args.warm else (lambda make: [make(i) for i in range(n)])
+    cases = {}
+
+    for pages in args.pdf_pages:
+        uploads = variants(lambda i, pages=pages: Upload(synthetic_pdf(pages, f"pdf-{pages}-{i}"),
+                                                         "application/pdf", f"bench-{pages}.pdf"))
+        cases[f"extract_text[{pages}p]"] = (utils.extract_text, uploads)
+
+    short_docs = variants(lambda i: synthetic_text(2500, f"short-{i}"))
+    long_docs = variants(lambda i: synthetic_text(60000, f"long-{i}"))
+    cases["generate_summary[short]"] = (utils.generate_summary, short_docs)
+    cases["generate_summary[long]"] = (utils.generate_summary, long_docs)
+    cases["ask_anything"] = (
+        lambda doc: utils.ask_anything(doc, "What was measured for the membrane protein?"), long_docs)
+    cases["challenge_me"] = (utils.challenge_me, short_docs)
+    cases["grade_open_answers"] = (
+        lambda doc: grade_open_answers([(f"Explain part {k} of the document?", doc[k * 100:k * 100 + 200])
+                                        for k in range(3)]),
+        short_docs)
+
+    if args.cases:
+        selected = set(args.cases)
+        cases = {name: case for name, case in cases.items() if name.split("[")[0] in selected or name in selected}
+    return cases
+
+
+def compare(results, baseline, tolerance):
+    """Print p50/p95 changes against the baseline; returns the names of regressed cases"""
+    regressions = []
+    print(f"\n{'case':28} {'metric':6} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            print(f"{name:28} (no baseline)")
+            continue
+        for metric in ("p50", "p95"):
+            change = (current[metric] - previous[metric]) / previous[metric] if previous[metric] else 0.0
+            flag = ""
+            if change > tolerance:
+                flag = "  REGRESSION"
+                regressions.append(name)
+            print(f"{name:28} {metric:6} {previous[metric]:>10.4f} {current[metric]:>10.4f} {change:>+8.1%}{flag}")
+    return sorted(set(regressions))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the assistant end to end against a mock Groq API")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=1, help="Iterations run in parallel (throughput under load)")
+    parser.add_argument("--cases", nargs="*", help="Case names to run, e.g. extract_text ask_anything")
+    parser.add_argument("--pdf-pages", type=int, nargs="*", default=[10, 100, 500])
+    parser.add_argument("--warm", action="store_true", help="Reuse inputs so caches are hit")
+    parser.add_argument("--latency", default="lognormal:0.05:0.5", help="Mock API latency distribution")
+    parser.add_argument("--token-delay", type=float, default=0.0)
+    parser.add_argument("--error-429", type=float, default=0.0)
+    parser.add_argument("--error-5xx", type=float, default=0.0)
+    parser.add_argument("--timeout-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--compare", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed p50/p95 slowdown before failing")
+    args = parser.parse_args()
+
+    config = MockConfig(args.latency, args.token_delay, args.error_429, args.error_5xx,
+                        args.timeout_rate, timeout_seconds=5.0, retry_after=0.2, seed=args.seed)
+    server, url = start_server(config)
+
+    # Point the client at the mock, lift the quota limiter and keep caches out of the working tree
+    scratch = tempfile.mkdtemp(prefix="bench-")
+    os.environ.update({
+        "GROQ_API_URL": url,
+        "GROQ_API_KEY": os.getenv("GROQ_API_KEY") or "mock",
+        "GROQ_RPM": "0",
+        "GROQ_TPM": "0",
+        "GROQ_READ_TIMEOUT": os.getenv("GROQ_READ_TIMEOUT", "2"),
+        "EXTRACTION_CACHE_DIR": os.path.join(scratch, "extraction"),
+        "QUESTION_BANK_DB": os.path.join(scratch, "question_bank.db"),
+    })
+
+    print("Preparing inputs...")
+    cases = build_cases(args)
+    results = {}
+    for name, (fn, inputs) in cases.items():
+        latencies, wall = run_case(fn, inputs, args.concurrency)
+        results[name] = summarize(latencies, wall)
+        r = results[name]
+        print(f"{name:28} n={r['iterations']:<4} {r['throughput']:>8.2f}/s  "
+              f"p50={r['p50']:.4f}s p95={r['p95']:.4f}s p99={r['p99']:.4f}s")
+    server.shutdown()
+    print(f"Mock API requests: {config.counts}")
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "settings": {key: value for key, value in vars(args).items()
+                     if key not in ("output", "baseline", "save_baseline", "compare")},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    if args.compare:
+        if not os.path.exists(args.baseline):
+            print(f"No baseline at {args.baseline}; run with --save-baseline first")
+            return 1
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline["results"], args.tolerance)
+        if regressions:
+            print(f"\nRegressed: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,242 @@
+# cache.py
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+
+def content_hash(data):
+    """Return the SHA-256 hex digest of bytes or text"""
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+
+class LRUCache:
+    """
+    Thread-safe in-memory LRU cache with hit/miss counters.
+    Entries older than ttl seconds are treated as misses when ttl is set.
+    """
+
+    def __init__(self, max_items=32, ttl=None):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at is None or expires_at > time.time():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        expires_at = time.time() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_items:
+                self._data.popitem(last=False)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"items": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+class DiskCache:
+    """
+    Directory-backed cache of compressed text entries.
+    Files are evicted least-recently-used first once the directory grows past max_bytes.
+    """
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.z")
+
+    def get(self, key, default=None):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                value = zlib.decompress(f.read()).decode('utf-8')
+            # Touch the file so eviction treats it as recently used
+            os.utime(path, None)
+        except (OSError, zlib.error, UnicodeDecodeError):
+            with self._lock:
+                self.misses += 1
+            return default
+        with self._lock:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path(key)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(zlib.compress(value.encode('utf-8'), 6))
+            os.replace(tmp_path, path)
+            self._evict()
+        except OSError:
+            pass  # Disk tier is best-effort, the memory tier still works
+
+    def set_stream(self, key, pieces):
+        """Store text given as an iterable of pieces, compressing as they come instead of joining them"""
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path(key)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            compressor = zlib.compressobj(6)
+            with open(tmp_path, "wb") as f:
+                for piece in pieces:
+                    f.write(compressor.compress(piece.encode('utf-8')))
+                f.write(compressor.flush())
+            os.replace(tmp_path, path)
+            self._evict()
+        except OSError:
+            pass
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            total = 0
+            for name in os.listdir(self.directory):
+                if not name.endswith(".z"):
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    continue
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+class SQLiteCache:
+    """
+    Persistent text cache in a single SQLite file, with optional TTL expiry
+    """
+
+    def __init__(self, path, ttl=None):
+        self.path = path
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+            )
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                row = self._conn.execute(
+                    "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+                ).fetchone()
+            except sqlite3.Error:
+                row = None
+            if row is not None and (row[1] is None or row[1] > time.time()):
+                self.hits += 1
+                return row[0]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        expires_at = time.time() + self.ttl if self.ttl else None
+        with self._lock:
+            try:
+                with self._conn:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+                        (key, value, expires_at)
+                    )
+                    self._conn.execute(
+                        "DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),)
+                    )
+            except sqlite3.Error:
+                pass  # Persistent tier is best-effort
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+class TieredCache:
+    """
+    Memory LRU in front of a persistent tier (DiskCache or SQLiteCache); persistent hits are promoted into memory
+    """
+
+    def __init__(self, memory, disk=None):
+        self.memory = memory
+        self.disk = disk
+
+    def get(self, key, default=None):
+        value = self.memory.get(key)
+        if value is not None:
+            return value
+        if self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.set(key, value)
+                return value
+        return default
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    def stats(self):
+        return {
+            "memory": self.memory.stats(),
+            "disk": self.disk.stats() if self.disk is not None else None,
+        }
@@ -0,0 +1,55 @@
+# chat_view.py
+
+import html
+import os
+import re
+
+# Messages shown at first; "Show earlier messages" reveals this many more each time
+WINDOW_MESSAGES = int(os.getenv("CHAT_WINDOW_MESSAGES", "20"))
+
+_BOLD = re.compile(r"\*\*(.+?)\*\*")
+
+USER_STYLE = "background-color: #2b313e; padding: 10px; border-radius: 10px; margin: 5px 0; margin-left: 20%;"
+ASSISTANT_STYLE = "background-color: #1e1e1e; padding: 10px; border-radius: 10px; margin: 5px 0; margin-right: 20%;"
+EVIDENCE_STYLE = "background-color: #2d2d2d; padding: 8px; border-left: 3px solid #4CAF50; margin: 5px 0;"
+
+
+def _format(text):
+    """Escape text for HTML, keeping **bold** and line breaks"""
+    return _BOLD.sub(r"<strong>\1</strong>", html.escape(text)).replace("\n", "<br>")
+
+
+def _evidence_html(snippets):
+    items = []
+    for i, snippet in enumerate(snippets, 1):
+        # Messages from before evidence carried offsets hold plain strings
+        text, page = (snippet, None) if isinstance(snippet, str) else (snippet["text"], snippet.get("page"))
+        location = f" (page {page})" if page else ""
+        items.append(f'<div style="{EVIDENCE_STYLE}"><strong>Evidence {i}{location}:</strong><br>'
+                     f'<em>"{html.escape(text)}"</em></div>')
+    return ('<details style="margin: 0 20% 5px 0;"><summary>📄 Supporting Evidence from Document</summary>'
+            + "".join(items) + "</details>")
+
+
+def message_html(message):
+    """HTML for one chat message (and its evidence), rendered once and kept on the message"""
+    cached = message.get("html")
+    if cached is not None:
+        return cached
+    if message["role"] == "user":
+        rendered = f'<div style="{USER_STYLE}"><strong>You:</strong> {_format(message["content"])}</div>'
+    else:
+        rendered = f'<div style="{ASSISTANT_STYLE}"><strong>🤖 Assistant:</strong> {_format(message["content"])}</div>'
+        if message.get("supporting_snippets"):
+            rendered += _evidence_html(message["supporting_snippets"])
+    message["html"] = rendered
+    return rendered
+
+
+def window_html(messages, visible):
+    """
+    HTML for the last `visible` messages as a single block, so a rerun emits one element
+    whatever the history length. Returns (html, hidden_count).
+    """
+    start = max(0, len(messages) - visible)
+    return "".join(message_html(message) for message in messages[start:]), start
@@ -0,0 +1,138 @@
+# context_packer.py
+
+import os
+import re
+from retrieval import get_index
+
+# Context windows (tokens) of the models groq_api may fall back to
+MODEL_CONTEXT = {
+    "llama3-8b-8192": 8192,
+    "llama3-70b-8192": 8192,
+    "mixtral-8x7b-32768": 32768,
+    "gemma-7b-it": 8192,
+}
+DEFAULT_CONTEXT = 8192
+
+# Share of the window we plan to use, leaving room for estimation error
+SAFETY_MARGIN = float(os.getenv("CONTEXT_SAFETY_MARGIN", "0.9"))
+# Upper bound on document tokens per request, so one call does not drain the token quota (0: no bound)
+MAX_INPUT_TOKENS = int(os.getenv("CONTEXT_MAX_INPUT_TOKENS", "4000"))
+
+# Words and individual punctuation marks; tokenizers split long words further
+_PIECE = re.compile(r"\w+|[^\w\s]")
+_SENTENCE = re.compile(r"[^.!?\n]+(?:[.!?]+|\n+|$)\s*")
+
+SEPARATOR = "\n...\n"
+
+
+def count_tokens(text):
+    """
+    Offline token estimate for Llama/Mixtral/Gemma-style tokenizers: one token per word or
+    punctuation mark, plus one per 7 characters of long words. Errs slightly high on prose.
+    """
+    pieces = _PIECE.findall(text)
+    return len(pieces) + sum(len(piece) // 7 for piece in pieces if len(piece) > 7) + 1
+
+
+def fits_budget(text, budget):
+    """True if text is within budget tokens; long texts are rejected without counting"""
+    # No token is longer than ~8 characters in practice
+    if len(text) <= budget:
+        return True
+    return len(text) <= budget * 8 and count_tokens(text) <= budget
+
+
+def context_window(models):
+    """Smallest context window among models, so a prompt fits whichever one answers"""
+    return min((MODEL_CONTEXT.get(model, DEFAULT_CONTEXT) for model in models), default=DEFAULT_CONTEXT)
+
+
+def fits_context(model, prompt_tokens, max_tokens):
+    """True if a prompt of prompt_tokens plus max_tokens of output fits the model's window"""
+    return prompt_tokens + max_tokens <= MODEL_CONTEXT.get(model, DEFAULT_CONTEXT)
+
+
+def input_budget(prompt, max_tokens, models):
+    """
+    Tokens left for document content in a prompt (everything except the document)
+    after reserving max_tokens of output, for the smallest window among models.
+    """
+    budget = int(context_window(models) * SAFETY_MARGIN) - max_tokens - count_tokens(prompt)
+    if MAX_INPUT_TOKENS > 0:
+        budget = min(budget, MAX_INPUT_TOKENS)
+    return max(0, budget)
+
+
+def _leading_sentences(chunk, budget):
+    """The longest run of whole sentences from the start of chunk within budget tokens"""
+    end = 0
+    used = 0
+    for match in _SENTENCE.finditer(chunk):
+        tokens = count_tokens(match.group())
+        if used + tokens > budget:
+            break
+        used += tokens
+        end = match.end()
+    return chunk[:end].rstrip(), used
+
+
+def truncate_to_budget(text, budget):
+    """Text unchanged if it fits budget tokens, otherwise its leading whole sentences that do"""
+    if fits_budget(text, budget):
+        return text
+    return _leading_sentences(text, budget)[0]
+
+
+def pack_context(text, budget, query=None):
+    """
+    Return as much of text as fits in budget tokens, sentence-aligned.
+    Chunks are taken in order of relevance (BM25 against query, or how central they are
+    to the document when there is no query) and emitted in document order; gaps between
+    non-adjacent chunks are marked with "...". Text that fits is returned unchanged.
+    """
+    if fits_budget(text, budget):
+        return text
+
+    index = get_index(text)
+    if not index.chunks:
+        return ""
+    if query:
+        ranked = [i for i, _ in index.top_chunks(query, k=len(index.chunks))]
+        matched = set(ranked)
+        ranked += [i for i in range(len(index.chunks)) if i not in matched]
+    else:
+        ranked = index.central_chunks()
+
+    selected = {}
+    used = 0
+    separator_tokens = count_tokens(SEPARATOR)
+    trimmed = False
+    for i in ranked:
+        if budget - used <= separator_tokens:
+            break
+        chunk = index.chunks[i]
+        # Cheap lower bound first: a chunk cannot be fewer tokens than len / 8
+        tokens = count_tokens(chunk) if len(chunk) // 8 <= budget - used else budget + 1
+        if used + tokens + separator_tokens <= budget:
+            selected[i] = chunk
+            used += tokens + separator_tokens
+        elif not trimmed:
+            # Keep the leading sentences of the first chunk that does not fit whole
+            trimmed = True
+            partial, tokens = _leading_sentences(chunk, budget - used - separator_tokens)
+            if partial:
+                selected[i] = partial
+                used += tokens + separator_tokens
+
+    if not selected:
+        partial, _ = _leading_sentences(index.chunks[0], budget)
+        return partial
+
+    parts = []
+    previous = None
+    for i in sorted(selected):
+        if previous is not None:
+            parts.append(" " if i == previous + 1 and selected[previous] is index.chunks[previous] else SEPARATOR)
+        parts.append(selected[i])
+        previous = i
+    return "".join(parts)
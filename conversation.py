@@ -0,0 +1,144 @@
+# conversation.py
+
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from groq_api import groq_chat
+from context_packer import count_tokens, truncate_to_budget
+from rate_limiter import PRIORITY_BACKGROUND
+
+# Turns kept verbatim, and the token budget for the whole memory block in a prompt
+RECENT_TURNS = int(os.getenv("CONVERSATION_RECENT_TURNS", "3"))
+MEMORY_TOKENS = int(os.getenv("CONVERSATION_MEMORY_TOKENS", "800"))
+
+# Share of the budget the rolling summary may use; the rest is for recent turns
+SUMMARY_SHARE = 0.4
+
+# Shared by every session; summaries are refreshed off the request path
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="conversation")
+
+_ANSWER_SECTION = re.compile(r'\*\*Answer:\*\*\s*(.*?)(?=\*\*Justification:\*\*|\*\*Supporting Evidence:\*\*|$)',
+                             re.DOTALL)
+
+
+def condense_answer(answer):
+    """Keep the direct answer of an Ask Anything response; justification and quotes are not needed later"""
+    match = _ANSWER_SECTION.search(answer)
+    return (match.group(1) if match else answer).strip()
+
+
+class ConversationMemory:
+    """
+    Memory of one chat: the last recent_turns (question, answer) pairs verbatim and a rolling
+    summary of everything older. Turns pushed out of the recent window are folded into the
+    summary on a background thread, so rendering the memory never waits for the model and
+    its size stays within budget_tokens however long the session runs.
+    """
+
+    def __init__(self, recent_turns=RECENT_TURNS, budget_tokens=MEMORY_TOKENS):
+        self.recent_turns = recent_turns
+        self.budget_tokens = budget_tokens
+        self.summary = ""
+        self.turns = []
+        self._folding = None
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self.turns)
+
+    def add_turn(self, question, answer):
+        """Record a completed exchange and start folding older turns into the summary if needed"""
+        with self._lock:
+            self.turns.append((question.strip(), condense_answer(answer)))
+        self._schedule_fold()
+
+    def clear(self):
+        with self._lock:
+            self.summary = ""
+            self.turns = []
+            self._generation += 1  # Results of folds already running are discarded
+
+    def _schedule_fold(self):
+        with self._lock:
+            if len(self.turns) <= self.recent_turns:
+                return
+            if self._folding is not None and not self._folding.done():
+                return  # The running fold reschedules itself when it finishes
+            overflow = self.turns[:len(self.turns) - self.recent_turns]
+            self._folding = _executor.submit(self._fold, self.summary, overflow, self._generation)
+
+    def _fold(self, summary, overflow, generation):
+        summary_tokens = int(self.budget_tokens * SUMMARY_SHARE)
+        exchanges = "\n".join(f"User: {question}\nAssistant: {answer}" for question, answer in overflow)
+        prompt = f"""
+    Update the running summary of a conversation about a document with the new exchanges below.
+    Keep what the user asked about, the answers given, and names, numbers and terms they may refer back to.
+    Write at most {int(summary_tokens * 0.7)} words of plain text.
+
+    Current summary:
+    {summary or "(none)"}
+
+    New exchanges:
+    {exchanges}
+
+    Updated summary:
+    """
+        response = groq_chat(prompt, temperature=0.2, max_tokens=summary_tokens, priority=PRIORITY_BACKGROUND)
+        with self._lock:
+            # This fold is over, so _schedule_fold may start the next one
+            self._folding = None
+            if response.startswith("Error:"):
+                return  # Keep the turns; the next add_turn retries the fold
+            if generation == self._generation:
+                self.summary = truncate_to_budget(response.strip(), summary_tokens)
+                # Drop exactly the folded turns; newer ones may have arrived meanwhile
+                self.turns = self.turns[len(overflow):]
+        # Fold turns that arrived meanwhile (or after a clear()) that add_turn left to this fold
+        self._schedule_fold()
+
+    def wait(self, timeout=None):
+        """Block until running folds, and the folds they start, finish"""
+        while (folding := self._folding) is not None:
+            folding.result(timeout=timeout)
+
+    def retrieval_query(self, question):
+        """Question plus the previous one, so follow-ups such as "why?" still retrieve the right passages"""
+        with self._lock:
+            previous = self.turns[-1][0] if self.turns else ""
+        return f"{previous} {question}".strip()
+
+    def render(self):
+        """
+        The memory as prompt text within budget_tokens: the summary, then as many of the
+        most recent turns as fit (newest first). Empty when there is nothing to remember.
+        """
+        with self._lock:
+            summary = self.summary
+            turns = self.turns[-self.recent_turns:] if self.recent_turns else []
+
+        parts = []
+        used = 0
+        if summary:
+            block = f"Summary of earlier conversation: {summary}"
+            used = count_tokens(block)
+            parts.append(block)
+
+        recent = []
+        for question, answer in reversed(turns):
+            block = f"User: {question}\nAssistant: {answer}"
+            tokens = count_tokens(block)
+            if used + tokens > self.budget_tokens:
+                remaining = self.budget_tokens - used - count_tokens(f"User: {question}\nAssistant: ")
+                if remaining <= 20 or recent:
+                    break
+                # Always keep the latest exchange, shortened to the room left
+                block = f"User: {question}\nAssistant: {truncate_to_budget(answer, remaining)}"
+                tokens = count_tokens(block)
+            recent.append(block)
+            used += tokens
+        if recent:
+            parts.append("Recent exchanges:\n" + "\n\n".join(reversed(recent)))
+        return "\n\n".join(parts)
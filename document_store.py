@@ -0,0 +1,281 @@
+# document_store.py
+
+import codecs
+import os
+import sys
+import threading
+import weakref
+import zlib
+from collections import OrderedDict
+from cache import content_hash
+
+STORE_MAX_BYTES = int(os.getenv("DOCUMENT_STORE_MAX_MB", "256")) * 1024 * 1024
+SPILL_CHUNK = 1024 * 1024
+STORE_DIR = os.getenv("DOCUMENT_STORE_DIR", os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), ".cache", "documents"))
+
+
+def _size_of(value):
+    if isinstance(value, str):
+        return sys.getsizeof(value)
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + 8 * len(value)
+    return 0
+
+
+class _Entry:
+    __slots__ = ("text", "length", "page_offsets", "artifacts", "refs", "spilled", "size")
+
+    def __init__(self, text, page_offsets):
+        self.text = text
+        self.length = len(text)
+        self.page_offsets = page_offsets
+        self.artifacts = {}
+        self.refs = 0
+        self.spilled = False
+        self.size = 0
+
+
+class DocumentStore:
+    """
+    Process-wide store of extracted documents keyed by content hash, shared by all sessions.
+    Holds each document's text, page offsets and small derived artifacts (summary, key facts)
+    once. Sessions hold a DocumentHandle, which counts as a reference.
+
+    Memory is bounded by max_bytes: least recently used documents are evicted first.
+    Unreferenced documents are dropped, referenced ones are spilled to disk and read back
+    on their next access.
+    """
+
+    def __init__(self, max_bytes=STORE_MAX_BYTES, directory=STORE_DIR):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self._entries = OrderedDict()
+        self._uploads = {}
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.spills = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def _path(self, doc_key):
+        return os.path.join(self.directory, f"{doc_key}.txt.z")
+
+    def _resize(self, entry):
+        size = _size_of(entry.page_offsets)
+        if entry.text is not None:
+            size += _size_of(entry.text)
+        size += sum(_size_of(value) for value in entry.artifacts.values())
+        self._bytes += size - entry.size
+        entry.size = size
+
+    def open_upload(self, upload_key):
+        """Return a DocumentHandle for an upload already extracted (by upload bytes hash), or None"""
+        with self._lock:
+            doc_key = self._uploads.get(upload_key)
+            if doc_key is None or doc_key not in self._entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return self.open(doc_key)
+
+    def add(self, text, page_offsets=None, upload_key=None):
+        """Store a document (or touch it if already stored) and return its key"""
+        doc_key = content_hash(text)
+        with self._lock:
+            entry = self._entries.get(doc_key)
+            if entry is None:
+                entry = self._entries[doc_key] = _Entry(text, list(page_offsets) if page_offsets else None)
+                self._resize(entry)
+            self._entries.move_to_end(doc_key)
+            if upload_key is not None:
+                self._uploads[upload_key] = doc_key
+            self._evict(keep=doc_key)
+        return doc_key
+
+    def add_and_open(self, text, page_offsets=None, upload_key=None):
+        """add() and open() in one step, so the new document cannot be evicted in between"""
+        with self._lock:
+            return self.open(self.add(text, page_offsets, upload_key))
+
+    def open(self, doc_key):
+        """Return a DocumentHandle holding a reference to a stored document"""
+        with self._lock:
+            entry = self._entries[doc_key]
+            entry.refs += 1
+            self._entries.move_to_end(doc_key)
+        return DocumentHandle(self, doc_key)
+
+    def release(self, doc_key):
+        with self._lock:
+            entry = self._entries.get(doc_key)
+            if entry is not None and entry.refs > 0:
+                entry.refs -= 1
+            self._evict()
+
+    def _iter_spilled(self, doc_key):
+        """Yield the text of a spilled document piece by piece, decompressing as it goes"""
+        decompressor = zlib.decompressobj()
+        decoder = codecs.getincrementaldecoder("utf-8")("surrogatepass")
+        with open(self._path(doc_key), "rb") as f:
+            while chunk := f.read(SPILL_CHUNK):
+                yield decoder.decode(decompressor.decompress(chunk))
+        yield decoder.decode(decompressor.flush(), final=True)
+
+    def _load(self, doc_key, entry):
+        """Bring a spilled document back into memory; caller holds the lock"""
+        entry.text = "".join(self._iter_spilled(doc_key))
+        self.loads += 1
+        self._resize(entry)
+
+    def document(self, doc_key):
+        """Return (text, page_offsets) for a stored document, reading it back from disk if spilled"""
+        with self._lock:
+            entry = self._entries[doc_key]
+            self._entries.move_to_end(doc_key)
+            if entry.text is None:
+                self._load(doc_key, entry)
+                self._evict(keep=doc_key)
+            return entry.text, entry.page_offsets
+
+    def info(self, doc_key):
+        """(length, page_offsets) of a stored document, without reading a spilled one back"""
+        with self._lock:
+            entry = self._entries[doc_key]
+            return entry.length, entry.page_offsets
+
+    def slice(self, doc_key, start, end):
+        """
+        text[start:end] of a stored document. A spilled document is decompressed only up to
+        end and not brought back into memory, so previews of large documents stay cheap.
+        """
+        with self._lock:
+            entry = self._entries[doc_key]
+            if entry.text is not None:
+                return entry.text[start:end]
+        pieces = []
+        position = 0
+        for piece in self._iter_spilled(doc_key):
+            if position + len(piece) > start:
+                pieces.append(piece[max(0, start - position):end - position])
+            position += len(piece)
+            if position >= end:
+                break
+        return "".join(pieces)
+
+    def set_artifact(self, doc_key, name, value):
+        """Keep a derived result (e.g. "summary") with the document; ignored if the document is gone"""
+        with self._lock:
+            entry = self._entries.get(doc_key)
+            if entry is None:
+                return
+            entry.artifacts[name] = value
+            self._resize(entry)
+            self._evict(keep=doc_key)
+
+    def get_artifact(self, doc_key, name, default=None):
+        with self._lock:
+            entry = self._entries.get(doc_key)
+            if entry is None:
+                return default
+            return entry.artifacts.get(name, default)
+
+    def _spill(self, doc_key, entry):
+        """Write a referenced document's text to disk and drop it from memory; caller holds the lock"""
+        if not entry.spilled:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f"{self._path(doc_key)}.{os.getpid()}.tmp"
+            compressor = zlib.compressobj(6)
+            with open(tmp_path, "wb") as f:
+                # Encoded piece by piece so spilling never holds a second full copy of the text
+                for start in range(0, len(entry.text), SPILL_CHUNK):
+                    f.write(compressor.compress(entry.text[start:start + SPILL_CHUNK].encode("utf-8", "surrogatepass")))
+                f.write(compressor.flush())
+            os.replace(tmp_path, self._path(doc_key))
+            entry.spilled = True
+        entry.text = None
+        self.spills += 1
+        self._resize(entry)
+
+    def _drop(self, doc_key, entry):
+        del self._entries[doc_key]
+        self._bytes -= entry.size
+        self.evictions += 1
+        if entry.spilled:
+            try:
+                os.remove(self._path(doc_key))
+            except OSError:
+                pass
+        for upload_key in [k for k, v in self._uploads.items() if v == doc_key]:
+            del self._uploads[upload_key]
+
+    def _evict(self, keep=None):
+        """Evict least recently used documents until under max_bytes; caller holds the lock"""
+        for doc_key in list(self._entries):
+            if self._bytes <= self.max_bytes:
+                return
+            if doc_key == keep:
+                continue
+            entry = self._entries[doc_key]
+            if entry.refs == 0:
+                self._drop(doc_key, entry)
+            elif entry.text is not None:
+                self._spill(doc_key, entry)
+
+    def stats(self):
+        with self._lock:
+            in_memory = sum(1 for entry in self._entries.values() if entry.text is not None)
+            return {
+                "documents": len(self._entries),
+                "in_memory": in_memory,
+                "spilled": len(self._entries) - in_memory,
+                "references": sum(entry.refs for entry in self._entries.values()),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "upload_hits": self.hits,
+                "upload_misses": self.misses,
+                "spills": self.spills,
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
+
+
+class DocumentHandle:
+    """
+    A session's reference to a stored document. The reference is released by release(),
+    or automatically when the handle is garbage collected with its session.
+    """
+
+    def __init__(self, store, doc_key):
+        self.store = store
+        self.doc_key = doc_key
+        self._finalizer = weakref.finalize(self, store.release, doc_key)
+
+    @property
+    def text(self):
+        return self.store.document(self.doc_key)[0]
+
+    @property
+    def page_offsets(self):
+        return self.store.info(self.doc_key)[1]
+
+    def __len__(self):
+        return self.store.info(self.doc_key)[0]
+
+    def slice(self, start, end):
+        return self.store.slice(self.doc_key, start, end)
+
+    def artifact(self, name, default=None):
+        return self.store.get_artifact(self.doc_key, name, default)
+
+    def set_artifact(self, name, value):
+        self.store.set_artifact(self.doc_key, name, value)
+
+    def release(self):
+        self._finalizer()
+
+
+# Shared by every session in the process
+store = DocumentStore()
@@ -0,0 +1,188 @@
+# evidence.py
+
+import os
+import re
+from array import array
+from bisect import bisect_right
+from difflib import SequenceMatcher
+import numpy as np
+from cache import LRUCache, content_hash
+
+# Word n-gram size used for candidate lookup
+NGRAM = 3
+# Ignore n-grams this common when voting; they carry no location information
+MAX_POSTINGS = 200
+# Minimum word-level similarity for a near-match
+MIN_SIMILARITY = 0.8
+# Odd 64-bit constant mixing word hashes into n-gram keys
+_NGRAM_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+# Words, with hyphenated line breaks ("exam-\nple") kept inside one word
+_WORD = re.compile(r"\w+(?:-[ \t]*\r?\n\s*\w+)*")
+_LINE_HYPHEN = re.compile(r"-[ \t]*\r?\n\s*")
+
+_QUOTED_PATTERNS = [
+    re.compile(r'"([^"]+)"'),  # Text in double quotes
+    re.compile(r"'([^']+)'"),  # Text in single quotes
+    re.compile(r'Supporting Evidence.*?["\']([^"\']+)["\']', re.IGNORECASE | re.DOTALL),  # Text after "Supporting Evidence"
+    re.compile(r'[“]([^”]+)[”]'),  # Text in curly quotes
+]
+
+_index_cache = LRUCache(max_items=int(os.getenv("EVIDENCE_CACHE_ITEMS", "8")))
+
+
+def _normalize_word(word):
+    return _LINE_HYPHEN.sub("", word).lower()
+
+
+def _words(text):
+    return [_normalize_word(m.group()) for m in _WORD.finditer(text)]
+
+
+def _ngram_keys(word_hashes):
+    """One 64-bit key per run of NGRAM consecutive word hashes (uint64 arithmetic wraps around)"""
+    count = len(word_hashes) - NGRAM + 1
+    if count <= 0:
+        return np.empty(0, dtype=np.uint64)
+    keys = word_hashes[:count].copy()
+    for i in range(1, NGRAM):
+        keys *= _NGRAM_MULTIPLIER
+        keys ^= word_hashes[i:i + count]
+    return keys
+
+
+def _hashes(words):
+    return np.array([hash(word) for word in words], dtype=np.int64).view(np.uint64)
+
+
+class EvidenceIndex:
+    """
+    Word-level index of a document, normalized for case, whitespace, punctuation and
+    hyphenated line breaks. Quotes are located through an n-gram inverted index, so
+    lookup cost depends on the quote, not the document length.
+
+    Everything is kept in flat numpy arrays (word character spans, word hashes and the
+    n-gram keys sorted with their positions), about 30 bytes per word. The index does
+    not hold the document text; locate() is given it.
+    """
+
+    def __init__(self, text, page_offsets=None):
+        self.page_offsets = list(page_offsets) if page_offsets else None
+        spans = array("i")
+        hashes = array("q")
+        for match in _WORD.finditer(text):
+            spans.append(match.start())
+            spans.append(match.end())
+            hashes.append(hash(_normalize_word(match.group())))
+        self.spans = np.frombuffer(spans, dtype=np.int32).reshape(-1, 2) if spans else np.empty((0, 2), dtype=np.int32)
+        self.word_hashes = np.frombuffer(hashes, dtype=np.int64).view(np.uint64) if hashes else np.empty(0, dtype=np.uint64)
+
+        # Postings as one sorted array: positions of an n-gram are a contiguous run
+        keys = _ngram_keys(self.word_hashes)
+        order = np.argsort(keys, kind="stable")
+        self.ngram_keys = keys[order]
+        self.ngram_positions = order.astype(np.int32)
+
+    def page_for_offset(self, offset):
+        """1-based page number for a character offset, or None without page information"""
+        if not self.page_offsets:
+            return None
+        return max(1, bisect_right(self.page_offsets, offset))
+
+    def _words_at(self, text, start, end):
+        return [_normalize_word(text[s:e]) for s, e in self.spans[start:end].tolist()]
+
+    def _positions(self, key):
+        low = np.searchsorted(self.ngram_keys, key, side="left")
+        high = np.searchsorted(self.ngram_keys, key, side="right")
+        # Stable sort: positions of one n-gram are in document order
+        return self.ngram_positions[low:high]
+
+    def locate(self, quote, text):
+        """
+        Find a quote (exactly or approximately) in the document text the index was built from.
+        Returns {"text", "start", "end", "page", "score"} or None.
+        """
+        quote_words = _words(quote)
+        if not quote_words:
+            return None
+        n = min(NGRAM, len(quote_words))
+
+        # Each matching n-gram votes for the document position where the quote would start
+        votes = {}
+        if n == NGRAM:
+            candidates = [(offset, self._positions(key)) for offset, key in enumerate(_ngram_keys(_hashes(quote_words)))]
+        else:
+            candidates = [(offset, self._short_positions(quote_words, text)) for offset in range(len(quote_words) - n + 1)]
+        for offset, positions in candidates:
+            if len(positions) > MAX_POSTINGS:
+                continue
+            for position in positions.tolist():
+                start = position - offset
+                votes[start] = votes.get(start, 0) + 1
+
+        best = None
+        for start, _ in sorted(votes.items(), key=lambda item: -item[1])[:5]:
+            start = max(0, start)
+            window = self._words_at(text, start, start + len(quote_words))
+            score = SequenceMatcher(None, quote_words, window, autojunk=False).ratio()
+            if best is None or score > best[0]:
+                best = (score, start, len(window))
+        if best is None or best[0] < MIN_SIMILARITY or best[2] == 0:
+            return None
+
+        score, start, length = best
+        char_start = int(self.spans[start][0])
+        char_end = int(self.spans[start + length - 1][1])
+        return {
+            "text": text[char_start:char_end],
+            "start": char_start,
+            "end": char_end,
+            "page": self.page_for_offset(char_start),
+            "score": round(score, 3),
+        }
+
+    def _short_positions(self, quote_words, text):
+        """Positions of quotes shorter than an n-gram, found by scanning the word hashes"""
+        matches = np.flatnonzero(self.word_hashes == _hashes(quote_words[:1])[0])
+        if len(matches) > MAX_POSTINGS:
+            matches = matches[:MAX_POSTINGS + 1]  # Too common to locate; only the count matters
+        return np.array([
+            position
+            for position in matches.tolist()
+            if self._words_at(text, position, position + len(quote_words)) == quote_words
+        ], dtype=np.int64)
+
+
+def get_evidence_index(text, page_offsets=None):
+    """Return the EvidenceIndex for a document, building it once per document"""
+    key = content_hash(text)
+    index = _index_cache.get(key)
+    if index is None:
+        index = EvidenceIndex(text, page_offsets)
+        _index_cache.set(key, index)
+    elif page_offsets and not index.page_offsets:
+        index.page_offsets = list(page_offsets)
+    return index
+
+
+def locate_quotes(response, text, page_offsets=None, limit=3, min_length=10):
+    """
+    Locate the passages a response quotes from the document.
+    Returns up to limit evidence dicts with character offsets and page numbers.
+    """
+    index = get_evidence_index(text, page_offsets)
+    evidence = []
+    seen = set()
+    for pattern in _QUOTED_PATTERNS:
+        for match in pattern.findall(response):
+            quote = match.strip()
+            if len(quote) <= min_length or quote.lower() in seen:
+                continue
+            seen.add(quote.lower())
+            found = index.locate(quote, text)
+            if found is not None and all(found["start"] != e["start"] for e in evidence):
+                evidence.append(found)
+                if len(evidence) >= limit:
+                    return evidence
+    return evidence
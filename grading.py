@@ -0,0 +1,143 @@
+# grading.py
+
+import json
+import re
+from cache import LRUCache, content_hash
+from groq_api import groq_chat, groq_chat_many
+from json_repair import parse_json_array
+from rate_limiter import PRIORITY_INTERACTIVE
+
+# Grades keyed by (question, normalized answer), so re-grading an identical answer is free
+_grade_cache = LRUCache(max_items=2048)
+
+_SCORE_PATTERN = re.compile(r'Score:\s*(\d+(?:\.\d+)?)\s*/\s*10', re.IGNORECASE)
+
+
+def normalize_answer(answer):
+    """Lowercase and collapse whitespace so trivially different answers share a grade"""
+    return " ".join(answer.lower().split())
+
+
+def grade_key(question, answer):
+    """Cache key for a (question, answer) pair"""
+    return content_hash(json.dumps([question.strip(), normalize_answer(answer)]))
+
+
+def format_grade(grade):
+    """Render a grade dict the way evaluations are shown in the app"""
+    if grade.get("score") is None:
+        return grade.get("feedback", "")
+    return f"Score: {grade['score']}/10\n\nFeedback: {grade['feedback']}"
+
+
+def _clamp_score(value):
+    try:
+        return max(0, min(10, int(round(float(value)))))
+    except (TypeError, ValueError):
+        return None
+
+
+def _batch_prompt(items):
+    numbered = "\n\n".join(
+        f"ID: {i}\nQuestion: {question}\nStudent Answer: {answer}"
+        for i, (question, answer) in enumerate(items, 1)
+    )
+    return f"""
+    Evaluate each student answer below for its question. For each one, give a score out of 10 and
+    detailed feedback covering what was good, what could be improved and key points that were missed.
+
+    {numbered}
+
+    Return ONLY this JSON format, one object per ID:
+    [
+        {{"id": 1, "score": 7, "feedback": "[detailed feedback]"}}
+    ]
+    """
+
+
+def _single_prompt(question, answer):
+    return f"""
+    Evaluate this answer for the given question. Provide a score out of 10 and detailed feedback.
+
+    Question: {question}
+    Student Answer: {answer}
+
+    Please provide:
+    1. Score out of 10
+    2. What was good about the answer
+    3. What could be improved
+    4. Key points that were missed (if any)
+
+    Format: Score: X/10
+    Feedback: [detailed feedback]
+    """
+
+
+def _parse_batch(response, count):
+    """Parse a batched grading response into {id: grade}; unparseable entries are left out"""
+    grades = {}
+    entries, _ = parse_json_array(response)
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        try:
+            item_id = int(entry.get("id"))
+        except (TypeError, ValueError):
+            continue
+        score = _clamp_score(entry.get("score"))
+        feedback = str(entry.get("feedback") or "").strip()
+        if 1 <= item_id <= count and score is not None and feedback:
+            grades[item_id] = {"score": score, "feedback": feedback}
+    return grades
+
+
+def _parse_single(response):
+    """Parse a 'Score: X/10 / Feedback: ...' response"""
+    match = _SCORE_PATTERN.search(response)
+    feedback = response.split("Feedback:", 1)[-1].strip() if "Feedback:" in response else response.strip()
+    return {"score": _clamp_score(match.group(1)) if match else None, "feedback": feedback}
+
+
+def grade_open_answers(items):
+    """
+    Grade open-ended answers, all pending ones in a single structured request.
+    items: list of (question, answer) pairs.
+    Returns one {"score", "feedback"} dict per item, in input order; score is None if it could not be parsed.
+    """
+    keys = [grade_key(question, answer) for question, answer in items]
+    results = [_grade_cache.get(key) for key in keys]
+    pending = [i for i, result in enumerate(results) if result is None]
+    if not pending:
+        return results
+
+    if len(pending) == 1:
+        # One answer needs no batching, use the plain evaluation prompt
+        i = pending[0]
+        response = groq_chat(_single_prompt(*items[i]), temperature=0.3, max_tokens=300, priority=PRIORITY_INTERACTIVE)
+        grades = {1: _parse_single(response)} if not response.startswith("Error:") else {}
+    else:
+        batch = [items[i] for i in pending]
+        response = groq_chat(_batch_prompt(batch), temperature=0.3, max_tokens=min(1500, 300 * len(batch) + 100),
+                             priority=PRIORITY_INTERACTIVE)
+        grades = _parse_batch(response, len(batch))
+
+        # Anything the batch response missed is graded individually, concurrently
+        missed = [n for n in range(1, len(batch) + 1) if n not in grades]
+        if missed:
+            responses = groq_chat_many([
+                {"prompt": _single_prompt(*batch[n - 1]), "temperature": 0.3, "max_tokens": 300,
+                 "priority": PRIORITY_INTERACTIVE}
+                for n in missed
+            ])
+            for n, single in zip(missed, responses):
+                if not single.startswith("Error:"):
+                    grades[n] = _parse_single(single)
+
+    for n, i in enumerate(pending, 1):
+        grade = grades.get(n)
+        if grade is None:
+            results[i] = {"score": None, "feedback": "Error: Unable to evaluate this answer right now. Please try again."}
+            continue
+        _grade_cache.set(keys[i], grade)
+        results[i] = grade
+    return results
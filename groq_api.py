@@ -1,92 +1,447 @@
 # groq_api.py
 
 import os
+import asyncio
+import json
+import threading
+import time
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
+from cache import LRUCache, SQLiteCache, TieredCache, content_hash
+from model_router import ModelRouter, backoff_delay, parse_retry_after
+from rate_limiter import RateLimiter, PRIORITY_INTERACTIVE, PRIORITY_NORMAL
+from context_packer import count_tokens, fits_context
+from metrics import LLMCall
 
 # Load environment variables
 load_dotenv()
 
+# Connection pool settings, shared by every caller in the process
+POOL_SIZE = int(os.getenv("GROQ_POOL_SIZE", "10"))
+CONNECT_TIMEOUT = float(os.getenv("GROQ_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("GROQ_READ_TIMEOUT", "45"))
+
+# Default cap on in-flight calls for the async helpers
+MAX_CONCURRENCY = int(os.getenv("GROQ_MAX_CONCURRENCY", str(POOL_SIZE)))
+
+# GROQ_API_URL points the client elsewhere, e.g. at mock_groq.py for benchmarks
+API_URL = os.getenv("GROQ_API_URL", "https://api.groq.com/openai/v1/chat/completions")
+SYSTEM_PROMPT = "You are a helpful AI assistant. When asked to provide JSON format, respond with valid JSON. Otherwise, respond in clear, natural text format."
+ERROR_MESSAGE = "Error: Unable to connect to Groq API. Please check your internet connection and API key."
+
+# Models in order of preference
+MODELS = [
+    "llama3-8b-8192",
+    "llama3-70b-8192", 
+    "mixtral-8x7b-32768",
+    "gemma-7b-it"
+]
+
+# Retry policy: attempts per model, overall time budget per call, and the longest
+# Retry-After we are willing to sleep through before switching models
+RETRIES_PER_MODEL = 2
+CALL_DEADLINE = float(os.getenv("GROQ_CALL_DEADLINE", "90"))
+MAX_RETRY_AFTER = float(os.getenv("GROQ_MAX_RETRY_AFTER", "5"))
+
+# Model order is chosen per call from live health instead of a fixed fallback walk
+router = ModelRouter(MODELS, max_read_timeout=READ_TIMEOUT)
+
+# Shared admission control in front of every API call, sized to the account quota (0 disables a limit)
+limiter = RateLimiter(
+    requests_per_minute=float(os.getenv("GROQ_RPM", "30")),
+    tokens_per_minute=float(os.getenv("GROQ_TPM", "6000"))
+)
+
+# Response cache: bounded LRU with TTL, plus an optional SQLite tier (set GROQ_CACHE_DB to a file path)
+RESPONSE_CACHE_TTL = float(os.getenv("GROQ_CACHE_TTL", "21600"))
+RESPONSE_CACHE_DB = os.getenv("GROQ_CACHE_DB", "")
+
+_response_cache = TieredCache(
+    LRUCache(max_items=int(os.getenv("GROQ_CACHE_ITEMS", "256")), ttl=RESPONSE_CACHE_TTL),
+    SQLiteCache(RESPONSE_CACHE_DB, ttl=RESPONSE_CACHE_TTL) if RESPONSE_CACHE_DB else None
+)
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """
+    Return the process-wide keep-alive session, creating it on first use.
+    Connections are pooled so repeated calls skip the TCP+TLS handshake.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                # pool_block keeps concurrent sessions from opening (and then discarding) extra sockets
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_SIZE, pool_block=True)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers.update({"Connection": "keep-alive"})
+                _session = session
+    return _session
+
+def get_connection_stats():
+    """Return how many requests were sent and how many reused a pooled connection"""
+    stats = {"requests": 0, "connections_opened": 0, "connections_reused": 0, "pool_size": POOL_SIZE}
+    if _session is None:
+        return stats
+    
+    for adapter in set(_session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            stats["requests"] += pool.num_requests
+            stats["connections_opened"] += pool.num_connections
+    stats["connections_reused"] = max(0, stats["requests"] - stats["connections_opened"])
+    return stats
+
+def _response_cache_key(prompt, temperature, max_tokens, json_mode=False):
+    """Cache key over the model set, whitespace-normalized prompt and sampling settings"""
+    normalized_prompt = " ".join(prompt.split())
+    return content_hash(json.dumps([MODELS, normalized_prompt, round(float(temperature), 3), max_tokens, json_mode]))
+
+def _headers():
+    return {
+        "Authorization": f"Bearer {os.getenv('GROQ_API_KEY')}",
+        "Content-Type": "application/json"
+    }
+
+def _build_payload(model, prompt, temperature, max_tokens, stream=False, json_mode=False):
+    payload = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+        "temperature": temperature,
+        "max_tokens": max_tokens
+    }
+    if stream:
+        payload["stream"] = True
+    if json_mode:
+        # The model is constrained to emit one valid JSON object
+        payload["response_format"] = {"type": "json_object"}
+    return payload
+
+def _failed_generation(response):
+    """The output Groq rejected in JSON mode (a 400 with code json_validate_failed), or None"""
+    try:
+        error = response.json().get("error") or {}
+        return error.get("failed_generation") or None
+    except (ValueError, AttributeError):
+        return None
+
+def get_response_cache_stats():
+    """Return hit/miss counters for the response cache tiers"""
+    return _response_cache.stats()
+
 def test_groq_connection():
     """Test if Groq API is accessible"""
     try:
-        response = groq_chat("Hello", temperature=0.1, max_tokens=10)
+        response = groq_chat("Hello", temperature=0.1, max_tokens=10, use_cache=False, priority=PRIORITY_INTERACTIVE)
         return not response.startswith("Error:")
     except:
         return False
 
-def groq_chat(prompt, temperature=0.7, max_tokens=500):
+def _models_for(prompt_tokens, max_tokens):
+    """Router order without models whose context window the request would overflow (a certain 400)"""
+    order = router.order()
+    return [model for model in order if fits_context(model, prompt_tokens, max_tokens)] or order
+
+def _wait_before_retry(delay, deadline):
+    """Sleep for delay seconds unless that would pass the call deadline; returns False if it would"""
+    if time.monotonic() + delay >= deadline:
+        return False
+    time.sleep(delay)
+    return True
+
+def groq_chat(prompt, temperature=0.7, max_tokens=500, use_cache=True, priority=PRIORITY_NORMAL, json_mode=False):
     """
-    Send a prompt to Groq API and get response
+    Send a prompt to Groq API and get response.
+    Identical requests are answered from the response cache unless use_cache=False
+    (use that when fresh sampling is wanted, e.g. regenerating questions).
+    Models are tried in the order chosen by the router from their live health, and every
+    attempt is admitted by the shared rate limiter according to priority.
+    json_mode=True requests a JSON object response (the prompt must mention JSON). Output Groq
+    rejects as invalid JSON is returned as is, for the caller to repair.
+    Latency, retries, model used and token usage are recorded in metrics.
     """
-    api_key = os.getenv("GROQ_API_KEY")
+    call = LLMCall("chat")
+    try:
+        return _groq_chat(call, prompt, temperature, max_tokens, use_cache, priority, json_mode)
+    finally:
+        call.finish()
+
+def _groq_chat(call, prompt, temperature, max_tokens, use_cache, priority, json_mode):
+    cache_key = _response_cache_key(prompt, temperature, max_tokens, json_mode)
+    if use_cache:
+        cached = _response_cache.get(cache_key)
+        if cached is not None:
+            call.cache_hit()
+            return cached
+    
+    headers = _headers()
+    deadline = time.monotonic() + CALL_DEADLINE
+    prompt_tokens = count_tokens(SYSTEM_PROMPT + prompt)
+    estimated_tokens = prompt_tokens + max_tokens
     
-    # Try different models in order of preference
-    models_to_try = [
-        "llama3-8b-8192",
-        "llama3-70b-8192", 
-        "mixtral-8x7b-32768",
-        "gemma-7b-it"
-    ]
+    # Try each model until one works, healthiest first; models with an open circuit are skipped
+    for model in _models_for(prompt_tokens, max_tokens):
+        if not router.allow(model):
+            continue
+        payload = _build_payload(model, prompt, temperature, max_tokens, json_mode=json_mode)
+        
+        for retry in range(RETRIES_PER_MODEL):
+            if not limiter.acquire(estimated_tokens, priority, timeout=deadline - time.monotonic()):
+                call.fail("rate_limited")
+                return ERROR_MESSAGE
+            call.attempt(model)
+            started = time.monotonic()
+            try:
+                response = get_session().post(API_URL, headers=headers, json=payload,
+                                              timeout=(CONNECT_TIMEOUT, router.read_timeout(model)))
+            except requests.exceptions.RequestException as e:
+                # Timeouts and connection errors: back off, then retry or move on
+                call.response(model, type(e).__name__)
+                router.record_failure(model)
+                if retry == RETRIES_PER_MODEL - 1 or not _wait_before_retry(backoff_delay(retry), deadline):
+                    break
+                continue
+            
+            call.response(model, response.status_code, response.elapsed.total_seconds())
+            if response.status_code == 200:
+                try:
+                    result = response.json()
+                    content = result['choices'][0]['message']['content'].strip()
+                except (ValueError, KeyError, IndexError, TypeError, AttributeError):
+                    call.fail("malformed_response")
+                    router.record_failure(model)
+                    break  # Malformed response, try next model
+                router.record_success(model, time.monotonic() - started)
+                usage = result.get('usage') or {}
+                limiter.record_usage(estimated_tokens, usage.get('total_tokens'))
+                call.succeeded(model, usage)
+                if use_cache:
+                    _response_cache.set(cache_key, content)
+                return content
+            elif response.status_code in (401, 403):
+                # Bad API key: every model would fail the same way
+                return ERROR_MESSAGE
+            elif response.status_code == 429:
+                # Rate limit: pause admissions for Retry-After (capped) and switch models rather than block for long
+                wait = parse_retry_after(response.headers.get("Retry-After"))
+                wait = backoff_delay(retry) if wait is None else wait
+                router.record_rate_limit(model, wait)
+                limiter.penalize(min(wait, MAX_RETRY_AFTER))
+                if wait > MAX_RETRY_AFTER or retry == RETRIES_PER_MODEL - 1:
+                    break
+                continue
+            elif response.status_code == 400:
+                # A bad request says nothing about the model's health, so the router is not told
+                failed_generation = _failed_generation(response) if json_mode else None
+                if failed_generation:
+                    # JSON mode rejected invalid output; the caller's repair path can usually fix it
+                    call.fail("json_validate_failed")
+                    return failed_generation
+                break  # Try next model
+            elif response.status_code == 404:
+                # Model unavailable, try next model
+                router.record_failure(model)
+                break
+            else:
+                # Server error: back off, then retry or move on
+                router.record_failure(model)
+                if retry == RETRIES_PER_MODEL - 1 or not _wait_before_retry(backoff_delay(retry), deadline):
+                    break
+        
+        if time.monotonic() >= deadline:
+            break
     
-    url = "https://api.groq.com/openai/v1/chat/completions"
+    # If all models fail, return a helpful error
+    return ERROR_MESSAGE
+
+def _iter_sse_content(response, usage=None):
+    """
+    Yield the content deltas of an OpenAI-compatible server-sent event stream.
+    Token usage sent with the final chunk (as "usage" or Groq's "x_groq.usage") is copied into usage.
+    """
+    for line in response.iter_lines():
+        if not line:
+            continue
+        line = line.decode('utf-8') if isinstance(line, bytes) else line
+        if not line.startswith("data:"):
+            continue
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            break
+        try:
+            chunk = json.loads(data)
+        except ValueError:
+            continue
+        chunk_usage = chunk.get("usage") or (chunk.get("x_groq") or {}).get("usage")
+        if usage is not None and chunk_usage:
+            usage.update(chunk_usage)
+        choices = chunk.get("choices") or []
+        if choices:
+            content = (choices[0].get("delta") or {}).get("content")
+            if content:
+                yield content
+
+def groq_chat_stream(prompt, temperature=0.7, max_tokens=500, use_cache=True, priority=PRIORITY_NORMAL):
+    """
+    Stream a response from Groq API, yielding text pieces as they arrive.
+    Models are tried in router order like groq_chat until one starts streaming.
+    Cached responses are yielded in a single piece; the full text is cached once the stream completes.
+    Groq does not stream JSON mode, so structured output is requested in the prompt instead.
+    """
+    call = LLMCall("stream")
+    try:
+        yield from _groq_chat_stream(call, prompt, temperature, max_tokens, use_cache, priority)
+    finally:
+        call.finish()
+
+def _groq_chat_stream(call, prompt, temperature, max_tokens, use_cache, priority):
+    cache_key = _response_cache_key(prompt, temperature, max_tokens)
+    if use_cache:
+        cached = _response_cache.get(cache_key)
+        if cached is not None:
+            call.cache_hit()
+            yield cached
+            return
     
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
+    headers = _headers()
+    deadline = time.monotonic() + CALL_DEADLINE
+    prompt_tokens = count_tokens(SYSTEM_PROMPT + prompt)
+    estimated_tokens = prompt_tokens + max_tokens
     
-    # Try each model until one works
-    for model in models_to_try:
-        payload = {
-            "model": model,
-            "messages": [
-                {"role": "system", "content": "You are a helpful AI assistant. When asked to provide JSON format, respond with valid JSON. Otherwise, respond in clear, natural text format."},
-                {"role": "user", "content": prompt}
-            ],
-            "temperature": temperature,
-            "max_tokens": max_tokens
-        }
+    for model in _models_for(prompt_tokens, max_tokens):
+        if not router.allow(model):
+            continue
+        payload = _build_payload(model, prompt, temperature, max_tokens, stream=True)
         
-        # Try each model with retries
-        for retry in range(2):  # 2 retries per model
+        for retry in range(RETRIES_PER_MODEL):
+            if not limiter.acquire(estimated_tokens, priority, timeout=deadline - time.monotonic()):
+                call.fail("rate_limited")
+                yield ERROR_MESSAGE
+                return
+            call.attempt(model)
+            started = time.perf_counter()
+            pieces = []
+            usage = {}
             try:
-                response = requests.post(url, headers=headers, json=payload, timeout=45)
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    return result['choices'][0]['message']['content'].strip()
-                elif response.status_code == 400:
-                    # Try next model if this one fails
-                    break  # Break retry loop, try next model
-                elif response.status_code == 429:
-                    # Rate limit, wait and retry
-                    import time
-                    time.sleep(2)
-                    continue
-                else:
+                with get_session().post(API_URL, headers=headers, json=payload, stream=True,
+                                        timeout=(CONNECT_TIMEOUT, router.read_timeout(model))) as response:
+                    if response.status_code != 200:
+                        call.response(model, response.status_code)
+                    if response.status_code in (401, 403):
+                        yield ERROR_MESSAGE
+                        return
+                    if response.status_code == 429:
+                        wait = parse_retry_after(response.headers.get("Retry-After"))
+                        wait = backoff_delay(retry) if wait is None else wait
+                        router.record_rate_limit(model, wait)
+                        limiter.penalize(min(wait, MAX_RETRY_AFTER))
+                        if wait > MAX_RETRY_AFTER:
+                            break
+                        continue
+                    if response.status_code in (400, 404):
+                        if response.status_code == 404:
+                            router.record_failure(model)  # A 400 is the request's fault, not the model's
+                        break  # Try next model
                     response.raise_for_status()
                     
-            except requests.exceptions.Timeout:
-                if retry == 1:  # Last retry for this model
-                    break  # Try next model
-                continue  # Retry same model
-            except requests.exceptions.ConnectionError:
-                if retry == 1:  # Last retry for this model
-                    break  # Try next model
-                import time
-                time.sleep(1)
-                continue  # Retry same model
+                    for piece in _iter_sse_content(response, usage):
+                        if not pieces:
+                            # Time to first token is what the user waits for when streaming
+                            call.response(model, 200, time.perf_counter() - started)
+                        pieces.append(piece)
+                        yield piece
+                
+                if not pieces:
+                    call.response(model, 200, time.perf_counter() - started)
+                # Stream latency depends on output length, so only the outcome feeds the router
+                router.record_success(model)
+                limiter.record_usage(estimated_tokens, usage.get("total_tokens"))
+                call.succeeded(model, usage)
+                content = "".join(pieces).strip()
+                if use_cache and content:
+                    _response_cache.set(cache_key, content)
+                return
+            except GeneratorExit:
+                # The caller stopped reading early (e.g. the page was rerun); the model was fine.
+                # Usage never arrives, so the admitted estimate stands
+                router.record_success(model)
+                call.cancelled(model)
+                raise
             except requests.exceptions.RequestException as e:
-                if "400" in str(e) or "401" in str(e):
-                    break  # Try next model
-                if retry == 1:  # Last retry for this model
-                    break  # Try next model
-                continue  # Retry same model
-            except Exception as e:
-                if retry == 1:  # Last retry for this model
-                    break  # Try next model
-                continue  # Retry same model
+                if pieces:
+                    call.fail("stream_interrupted")
+                elif not isinstance(e, requests.exceptions.HTTPError):  # HTTP errors were recorded above
+                    call.response(model, type(e).__name__)
+                router.record_failure(model)
+                if pieces:
+                    return  # Stream broke after output was shown, a retry would repeat it
+                if retry == RETRIES_PER_MODEL - 1 or not _wait_before_retry(backoff_delay(retry), deadline):
+                    break
+                continue
+        
+        if time.monotonic() >= deadline:
+            break
     
-    # If all models fail, return a helpful error
-    return "Error: Unable to connect to Groq API. Please check your internet connection and API key."
\ No newline at end of file
+    yield ERROR_MESSAGE
+
+def get_model_health():
+    """Return the router's live per-model health (state, success rate, latency EWMA/p95)"""
+    return router.snapshot()
+
+def get_rate_limiter_stats():
+    """Return queue length, admissions per priority and average admission wait"""
+    return limiter.stats()
+
+async def async_groq_chat(prompt, temperature=0.7, max_tokens=500, use_cache=True, priority=PRIORITY_NORMAL,
+                          json_mode=False, semaphore=None):
+    """
+    Async counterpart of groq_chat.
+    The call runs on a worker thread so it shares the pooled session and response cache;
+    pass a semaphore to bound how many calls are in flight at once.
+    """
+    if semaphore is None:
+        return await asyncio.to_thread(groq_chat, prompt, temperature, max_tokens, use_cache, priority, json_mode)
+    async with semaphore:
+        return await asyncio.to_thread(groq_chat, prompt, temperature, max_tokens, use_cache, priority, json_mode)
+
+async def async_groq_chat_many(calls, max_concurrency=None):
+    """Run several groq_chat calls concurrently; results keep the order of calls"""
+    semaphore = asyncio.Semaphore(max_concurrency or MAX_CONCURRENCY)
+    return await asyncio.gather(*(
+        async_groq_chat(**_call_kwargs(call), semaphore=semaphore) for call in calls
+    ))
+
+def _call_kwargs(call):
+    """Accept either a bare prompt or a dict of groq_chat keyword arguments"""
+    return {"prompt": call} if isinstance(call, str) else dict(call)
+
+def groq_chat_many(calls, max_concurrency=None):
+    """
+    Run independent groq_chat calls concurrently from synchronous code (e.g. the Streamlit script thread).
+    Each call is a prompt string or a dict of groq_chat keyword arguments; results keep input order,
+    so total time is roughly that of the slowest call.
+    """
+    calls = list(calls)
+    if not calls:
+        return []
+    
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(async_groq_chat_many(calls, max_concurrency))
+    
+    # Already inside an event loop on this thread, so run on a private loop in another thread
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, async_groq_chat_many(calls, max_concurrency)).result()
@@ -0,0 +1,154 @@
+# json_repair.py
+
+import json
+import re
+import threading
+from collections import Counter
+from metrics import registry
+
+_decoder = json.JSONDecoder()
+
+_TRAILING_COMMA = re.compile(r',\s*([\]}])')
+_PYTHON_LITERALS = re.compile(r'(?<=[:\[,\s])(True|False|None)(?=\s*[,\]}])')
+_SMART_QUOTES = str.maketrans({'“': '"', '”': '"'})
+
+# How often each parsing path is taken (direct parse, local repair, salvage, repair call, ...)
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def record_path(path):
+    with _stats_lock:
+        _stats[path] += 1
+    registry.inc("json_parse_path_total", path=path)
+
+
+def get_parse_stats():
+    """Return how many times each JSON parsing / recovery path was taken"""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def strip_fences(text):
+    """Return the body of the first ``` code fence, or the text unchanged"""
+    if '```' not in text:
+        return text
+    body = text.split('```', 2)[1]
+    if body.startswith('json'):
+        body = body[len('json'):]
+    return body
+
+
+def _repair(text, quotes=False):
+    """
+    Fix the usual model slips: trailing commas and Python literals.
+    quotes=True also turns curly double quotes into JSON quotes (only valid when they delimit strings).
+    """
+    text = _TRAILING_COMMA.sub(r'\1', text)
+    text = _PYTHON_LITERALS.sub(lambda m: {"True": "true", "False": "false", "None": "null"}[m.group(1)], text)
+    return text.translate(_SMART_QUOTES) if quotes else text
+
+
+def _skip_separators(text, pos):
+    while pos < len(text) and text[pos] in ' \t\r\n,':
+        pos += 1
+    return pos
+
+
+class IncrementalArrayParser:
+    """
+    Pulls complete items out of a JSON array as text arrives, e.g. from a token stream.
+    The first '[' starts the array, so {"questions": [...]} wrappers and leading prose are fine.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = None
+        self.done = False
+
+    def feed(self, chunk):
+        """Add text and return the items completed by it"""
+        self.buffer += chunk
+        items = []
+        if self.pos is None:
+            start = self.buffer.find('[')
+            if start < 0:
+                return items
+            self.pos = start + 1
+
+        while not self.done:
+            pos = _skip_separators(self.buffer, self.pos)
+            if pos >= len(self.buffer):
+                break
+            if self.buffer[pos] == ']':
+                self.done = True
+                break
+            try:
+                item, end = _decoder.raw_decode(self.buffer, pos)
+            except json.JSONDecodeError:
+                break  # Item not complete yet (or malformed, see finish)
+            items.append(item)
+            self.pos = end
+        return items
+
+    def finish(self):
+        """
+        Salvage what remains once the input is complete: repair the tail and skip
+        items that still do not parse. A truncated final item is dropped.
+        """
+        if self.pos is None or self.done:
+            return []
+        tail = _repair(self.buffer[self.pos:])
+        items = []
+        pos = 0
+        while pos < len(tail):
+            pos = _skip_separators(tail, pos)
+            if pos >= len(tail) or tail[pos] == ']':
+                break
+            try:
+                item, pos = _decoder.raw_decode(tail, pos)
+                items.append(item)
+            except json.JSONDecodeError:
+                next_item = tail.find('{', pos + 1)
+                if next_item < 0:
+                    break
+                pos = next_item
+        self.done = True
+        return items
+
+
+def _unwrap(value):
+    """Accept a bare array or an object wrapping one (as JSON mode produces)"""
+    if isinstance(value, list):
+        return value
+    if isinstance(value, dict):
+        for item in value.values():
+            if isinstance(item, list):
+                return item
+    return None
+
+
+def parse_json_array(text):
+    """
+    Parse a model response that should contain a JSON array, as tolerantly as possible.
+    Returns (items, path) where path is "direct", "repaired", "salvaged" or "failed".
+    """
+    body = strip_fences(text.strip())
+    start = min([i for i in (body.find('['), body.find('{')) if i >= 0], default=-1)
+    if start >= 0:
+        candidate = body[start:max(body.rfind(']'), body.rfind('}')) + 1]
+        attempts = (("direct", candidate), ("repaired", _repair(candidate)), ("repaired", _repair(candidate, quotes=True)))
+        for path, attempt in attempts:
+            try:
+                items = _unwrap(json.loads(attempt))
+            except ValueError:
+                continue
+            if items is not None:
+                record_path(path)
+                return items, path
+
+    parser = IncrementalArrayParser()
+    items = parser.feed(body) + parser.finish()
+    path = "salvaged" if items else "failed"
+    record_path(path)
+    return items, path
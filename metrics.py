@@ -0,0 +1,300 @@
+# metrics.py
+
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Histogram buckets in seconds, from cache hits to slow multi-model fallbacks
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Completed top-level spans (one per user action) kept for the diagnostics panel
+TRACE_HISTORY = int(os.getenv("METRICS_TRACE_HISTORY", "50"))
+
+_HELP = {
+    "groq_calls_total": ("counter", "LLM calls by kind and outcome (ok, cache, cancelled, error)"),
+    "groq_call_seconds": ("histogram", "Wall time of LLM calls including retries and fallbacks"),
+    "groq_ttfb_seconds": ("histogram", "Time to first byte of successful API responses"),
+    "groq_requests_total": ("counter", "HTTP attempts by model and status"),
+    "groq_retries_total": ("counter", "Attempts beyond the first within one call"),
+    "groq_call_errors_total": ("counter", "Failed LLM calls by last failure reason"),
+    "groq_tokens_total": ("counter", "Tokens reported in the API usage field"),
+    "stage_seconds": ("histogram", "Duration of traced pipeline stages"),
+    "json_parse_path_total": ("counter", "Model JSON responses by the parsing or recovery path that produced them"),
+    "api_requests_total": ("counter", "HTTP API responses by endpoint and status"),
+    "normalized_chars_removed_total": ("counter", "Characters of boilerplate and whitespace removed from extracted text"),
+    "normalized_tokens_removed_total": ("counter", "Estimated prompt tokens removed from extracted text"),
+}
+
+
+class Registry:
+    """Thread-safe counters and histograms with labels, exportable in Prometheus text format"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram["buckets"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def counter_values(self, name):
+        """Return {labels_tuple: value} for one counter"""
+        with self._lock:
+            return {labels: value for (n, labels), value in self._counters.items() if n == name}
+
+    def histogram_summaries(self, name):
+        """Return {labels_tuple: {"count", "mean"}} for one histogram"""
+        with self._lock:
+            return {
+                labels: {"count": h["count"], "mean": h["sum"] / h["count"] if h["count"] else 0.0}
+                for (n, labels), h in self._histograms.items() if n == name
+            }
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def export(self):
+        """Render every metric in the Prometheus text exposition format"""
+        def fmt_labels(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+            return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((k, dict(v, buckets=list(v["buckets"]))) for k, v in self._histograms.items())
+
+        lines = []
+        described = set()
+
+        def describe(name, kind):
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {_HELP.get(name, (kind, name))[1]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            describe(name, "counter")
+            lines.append(f"{name}{fmt_labels(labels)} {value:g}")
+        for (name, labels), histogram in histograms:
+            describe(name, "histogram")
+            for bound, count in zip(self.buckets, histogram["buckets"]):
+                lines.append(f"{name}_bucket{fmt_labels(labels, [('le', f'{bound:g}')])} {count}")
+            lines.append(f"{name}_bucket{fmt_labels(labels, [('le', '+Inf')])} {histogram['count']}")
+            lines.append(f"{name}_sum{fmt_labels(labels)} {histogram['sum']:.6f}")
+            lines.append(f"{name}_count{fmt_labels(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def export_prometheus():
+    """Return all metrics in Prometheus text format"""
+    return registry.export()
+
+
+class Span:
+    """A timed stage; spans opened while another is active become its children"""
+
+    def __init__(self, name, attributes=None, parent=None):
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.parent = parent
+        self.children = []
+        self.start = time.perf_counter()
+        self.started_at = time.time()
+        self.duration = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def finish(self):
+        if self.duration is None:
+            self.duration = time.perf_counter() - self.start
+
+    def to_dict(self):
+        with _trace_lock:
+            children = list(self.children)
+        return {
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1000, 1) if self.duration is not None else None,
+            "attributes": self.attributes,
+            "children": [child.to_dict() for child in children],
+        }
+
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_recent_traces = deque(maxlen=TRACE_HISTORY)
+_trace_lock = threading.Lock()
+
+
+def _attach(span):
+    """Record a finished span under its parent, or as a new trace if it has none"""
+    with _trace_lock:
+        if span.parent is not None:
+            span.parent.children.append(span)
+        else:
+            _recent_traces.append(span)
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Time a stage. Nested calls (in the same thread, or in threads started with a copied
+    context such as asyncio.to_thread) become children; the outermost span is one trace.
+    """
+    current = Span(name, attributes, _current_span.get())
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.set(error=type(e).__name__)
+        raise
+    finally:
+        _current_span.reset(token)
+        current.finish()
+        registry.observe("stage_seconds", current.duration, stage=name)
+        _attach(current)
+
+
+def current_span():
+    return _current_span.get()
+
+
+def recent_traces(limit=None):
+    """Return the most recent traces as nested dicts, newest first"""
+    with _trace_lock:
+        traces = list(_recent_traces)[::-1]
+    return [trace.to_dict() for trace in traces[:limit]]
+
+
+def format_trace(trace, indent=0):
+    """Render a trace dict as an indented text tree"""
+    details = ", ".join(f"{k}={v}" for k, v in trace["attributes"].items())
+    lines = [f"{'  ' * indent}{trace['name']}: {trace['duration_ms']} ms" + (f" ({details})" if details else "")]
+    for child in trace["children"]:
+        lines.append(format_trace(child, indent + 1))
+    return "\n".join(lines)
+
+
+class LLMCall:
+    """
+    Collects what happened during one groq_chat / groq_chat_stream call and records it on finish().
+    Unlike span(), it does not become the current span, so it is safe to use inside generators.
+    """
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.span = Span(f"llm.{kind}", parent=_current_span.get())
+        self.attempts = 0
+        self.model = None
+        self.ttfb = None
+        self.usage = None
+        self.outcome = "error"
+        self.error = None
+
+    def attempt(self, model):
+        self.attempts += 1
+        self.model = model
+
+    def response(self, model, status, ttfb=None):
+        """Record one HTTP response (or the exception name when no response arrived)"""
+        registry.inc("groq_requests_total", model=model, status=status)
+        if status != 200:
+            self.error = str(status)
+        elif ttfb is not None:
+            self.ttfb = ttfb
+
+    def cache_hit(self):
+        self.outcome = "cache"
+
+    def succeeded(self, model, usage=None):
+        self.outcome = "ok"
+        self.model = model
+        self.usage = usage or None
+
+    def cancelled(self, model):
+        """The caller closed a stream before it finished"""
+        self.outcome = "cancelled"
+        self.model = model
+
+    def fail(self, reason):
+        self.error = reason
+
+    def finish(self):
+        self.span.finish()
+        registry.inc("groq_calls_total", kind=self.kind, outcome=self.outcome)
+        registry.observe("groq_call_seconds", self.span.duration, kind=self.kind, outcome=self.outcome)
+        if self.attempts > 1:
+            registry.inc("groq_retries_total", self.attempts - 1, kind=self.kind)
+        if self.outcome == "ok":
+            if self.ttfb is not None:
+                registry.observe("groq_ttfb_seconds", self.ttfb, model=self.model)
+            for field in ("prompt_tokens", "completion_tokens"):
+                if self.usage and self.usage.get(field):
+                    registry.inc("groq_tokens_total", self.usage[field], model=self.model, type=field.split("_")[0])
+        elif self.outcome == "error":
+            registry.inc("groq_call_errors_total", kind=self.kind, reason=self.error or "unknown")
+
+        self.span.set(outcome=self.outcome, model=self.model, attempts=self.attempts)
+        if self.ttfb is not None:
+            self.span.set(ttfb_ms=round(self.ttfb * 1000, 1))
+        if self.usage:
+            self.span.set(prompt_tokens=self.usage.get("prompt_tokens"),
+                          completion_tokens=self.usage.get("completion_tokens"))
+        if self.outcome == "error":
+            self.span.set(error=self.error)
+        # Calls outside any action (background precompute, memory folds) are counted in the
+        # metrics above but are not user actions, so they are kept out of the recent traces
+        if self.span.parent is not None:
+            _attach(self.span)
+
+
+def llm_summary():
+    """Aggregate LLM call figures for display: calls by outcome, retries, tokens and mean latency"""
+    calls = {}
+    for labels, value in registry.counter_values("groq_calls_total").items():
+        outcome = dict(labels)["outcome"]
+        calls[outcome] = calls.get(outcome, 0) + value
+    tokens = {}
+    for labels, value in registry.counter_values("groq_tokens_total").items():
+        kind = dict(labels)["type"]
+        tokens[kind] = tokens.get(kind, 0) + value
+    latency = {
+        f"{dict(labels)['kind']}/{dict(labels)['outcome']}": round(summary["mean"], 3)
+        for labels, summary in registry.histogram_summaries("groq_call_seconds").items()
+    }
+    return {
+        "calls": calls,
+        "retries": sum(registry.counter_values("groq_retries_total").values()),
+        "tokens": tokens,
+        "mean_seconds": latency,
+    }
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Groq chat completions endpoint, for benchmarks and offline runs.
+
+    python mock_groq.py --port 8765 --latency lognormal:0.4:0.5 --error-429 0.05
+    GROQ_API_URL=http://127.0.0.1:8765/openai/v1/chat/completions streamlit run app.py
+
+Responses are canned by prompt type (questions, grades, key facts, summaries, answers),
+so the app's parsers exercise the same paths they do against the real API.
+"""
+
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CHAT_PATH = "/openai/v1/chat/completions"
+
+
+class LatencyModel:
+    """
+    Response delay in seconds drawn from a distribution spec:
+    "fixed:S", "uniform:LO:HI", "normal:MEAN:STDDEV" or "lognormal:MEDIAN:SIGMA".
+    """
+
+    def __init__(self, spec="fixed:0"):
+        kind, *params = spec.split(":")
+        self.spec = spec
+        self.kind = kind
+        self.params = [float(p) for p in params]
+        if kind not in ("fixed", "uniform", "normal", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {spec}")
+
+    def sample(self, rng=random):
+        if self.kind == "fixed":
+            return self.params[0] if self.params else 0.0
+        if self.kind == "uniform":
+            return rng.uniform(*self.params)
+        if self.kind == "normal":
+            return max(0.0, rng.gauss(*self.params))
+        median, sigma = self.params
+        return rng.lognormvariate(math.log(median), sigma) if median > 0 else 0.0
+
+
+class MockConfig:
+    """Behaviour of the mock server; error rates are probabilities per request"""
+
+    def __init__(self, latency="fixed:0", token_delay=0.0, error_429=0.0, error_5xx=0.0,
+                 timeout_rate=0.0, timeout_seconds=60.0, retry_after=1.0, seed=None):
+        self.latency = LatencyModel(latency)
+        self.token_delay = token_delay
+        self.error_429 = error_429
+        self.error_5xx = error_5xx
+        self.timeout_rate = timeout_rate
+        self.timeout_seconds = timeout_seconds
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {"requests": 0, "ok": 0, "429": 0, "5xx": 0, "timeout": 0, "stream": 0}
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] += 1
+
+    def roll(self):
+        """Pick this request's outcome: "429", "5xx", "timeout" or "ok" """
+        with self.lock:
+            value = self.rng.random()
+            delay = self.latency.sample(self.rng)
+        for outcome, rate in (("429", self.error_429), ("5xx", self.error_5xx), ("timeout", self.timeout_rate)):
+            if value < rate:
+                return outcome, delay
+            value -= rate
+        return "ok", delay
+
+
+_WORD = re.compile(r"[A-Za-z][A-Za-z\-]{3,}")
+
+
+def _document_sentence(prompt):
+    """A sentence from the prompt's document section, so answers quote something real"""
+    match = re.search(r"Document:\s*(.+?)\n\s*Question:", prompt, re.DOTALL)
+    if not match:
+        return ""
+    sentences = [s.strip() for s in re.split(r"(?<=[.!?])\s+", match.group(1)) if len(s.strip()) > 30]
+    return sentences[0] if sentences else ""
+
+
+def _terms(prompt, count=8):
+    words = []
+    for word in _WORD.findall(prompt):
+        if word.lower() not in words:
+            words.append(word.lower())
+    return (words or ["concept"])[-count:]
+
+
+def canned_content(prompt, json_mode=False):
+    """Return a plausible model response for one of the app's prompts"""
+    terms = _terms(prompt)
+
+    # Question generation: mirror the types shown in the requested JSON format
+    types = re.findall(r'"type": "(mcq|open)"', prompt)
+    if types and "Student Answer" not in prompt:
+        count_match = re.search(r"Create (\d+) different", prompt)
+        if count_match:
+            types = [types[0]] * int(count_match.group(1))
+        questions = []
+        for i, qtype in enumerate(types):
+            term = terms[i % len(terms)]
+            if qtype == "open":
+                questions.append({"question": f"Explain how {term} relates to the findings in part {i + 1} of the document?",
+                                  "type": "open"})
+            else:
+                questions.append({
+                    "question": f"According to the document, what is stated about {term} (item {i + 1})?",
+                    "type": "mcq",
+                    "options": [f"A) {term} is central", f"B) {term} is absent", f"C) {term} is disputed",
+                                f"D) {term} is unrelated"],
+                    "correct_answer": "A",
+                    "explanation": f"The document describes {term} as central.",
+                })
+        return json.dumps({"questions": questions} if json_mode else questions)
+
+    if "Student Answer" in prompt:
+        ids = re.findall(r"^\s*ID: (\d+)", prompt, re.MULTILINE)
+        if ids:
+            return json.dumps([{"id": int(i), "score": 7, "feedback": "Covers the main idea; add specific evidence."}
+                               for i in ids])
+        return "Score: 7/10\nFeedback: Covers the main idea; add specific evidence from the document."
+
+    if "extract specific, factual information" in prompt:
+        return "\n".join(f"- {term.capitalize()}: mentioned in the document" for term in terms)
+
+    if "Question:" in prompt and "Supporting Evidence" in prompt:
+        quote = _document_sentence(prompt)
+        return (f"**Answer:** The document discusses {terms[-1]}.\n\n"
+                f"**Justification:** It is described directly in the text.\n\n"
+                f"**Supporting Evidence:** \"{quote}\"")
+
+    if "summary" in prompt.lower() or "Summarize" in prompt:
+        return ("This document covers " + ", ".join(terms[:5]) + ". " +
+                "It explains the main points, key arguments and conclusions in a structured way. " * 3).strip()
+
+    return "OK"
+
+
+class MockGroqHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "MockGroq/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self._send_json(200, self.server.config.counts)
+        else:
+            self._send_json(404, {"error": {"message": "Not found"}})
+
+    def do_POST(self):
+        config = self.server.config
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": {"message": "Invalid JSON"}})
+            return
+        if self.path != CHAT_PATH:
+            self._send_json(404, {"error": {"message": "Not found"}})
+            return
+
+        config.count("requests")
+        outcome, delay = config.roll()
+        if outcome == "429":
+            config.count("429")
+            self._send_json(429, {"error": {"message": "Rate limit reached"}},
+                            {"Retry-After": f"{config.retry_after:g}"})
+            return
+        if outcome == "5xx":
+            config.count("5xx")
+            time.sleep(delay)
+            self._send_json(503, {"error": {"message": "Service unavailable"}})
+            return
+        if outcome == "timeout":
+            config.count("timeout")
+            time.sleep(config.timeout_seconds)
+            self.close_connection = True
+            return
+
+        messages = payload.get("messages") or [{}]
+        prompt = messages[-1].get("content", "")
+        json_mode = (payload.get("response_format") or {}).get("type") == "json_object"
+        content = canned_content(prompt, json_mode)
+        usage = {
+            "prompt_tokens": len(prompt) // 4,
+            "completion_tokens": len(content) // 4,
+            "total_tokens": (len(prompt) + len(content)) // 4,
+        }
+
+        # Latency is time to first byte; streaming then paces tokens at token_delay
+        time.sleep(delay)
+        config.count("ok")
+        if payload.get("stream"):
+            config.count("stream")
+            self._stream(payload.get("model"), content, config.token_delay, usage)
+        else:
+            self._send_json(200, {
+                "id": "mock-completion",
+                "object": "chat.completion",
+                "model": payload.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                             "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+    def _stream(self, model, content, token_delay, usage):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def write_event(data):
+            chunk = f"data: {data}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(chunk):X}\r\n".encode("ascii") + chunk + b"\r\n")
+            self.wfile.flush()
+
+        for piece in re.findall(r"\S+\s*", content):
+            write_event(json.dumps({"model": model, "choices": [{"index": 0, "delta": {"content": piece}}]}))
+            if token_delay:
+                time.sleep(token_delay)
+        # Groq reports usage on the last chunk under x_groq
+        write_event(json.dumps({"model": model, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                                "x_groq": {"usage": usage}}))
+        write_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def make_server(config=None, host="127.0.0.1", port=0):
+    server = ThreadingHTTPServer((host, port), MockGroqHandler)
+    server.daemon_threads = True
+    server.config = config or MockConfig()
+    return server
+
+
+def start_server(config=None, host="127.0.0.1", port=0):
+    """
+    Start the mock server on a background thread.
+    Returns (server, url) where url is the chat completions endpoint; call server.shutdown() to stop.
+    """
+    server = make_server(config, host, port)
+    threading.Thread(target=server.serve_forever, name="mock-groq", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}{CHAT_PATH}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local mock of the Groq chat completions API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", default="lognormal:0.4:0.5",
+                        help="fixed:S, uniform:LO:HI, normal:MEAN:SD or lognormal:MEDIAN:SIGMA (seconds)")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="Seconds between streamed tokens")
+    parser.add_argument("--error-429", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--error-5xx", type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument("--timeout-rate", type=float, default=0.0, help="Fraction of requests that hang")
+    parser.add_argument("--timeout-seconds", type=float, default=60.0, help="How long hanging requests hang")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After sent with 429s")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    config = MockConfig(args.latency, args.token_delay, args.error_429, args.error_5xx,
+                        args.timeout_rate, args.timeout_seconds, args.retry_after, args.seed)
+    server = make_server(config, args.host, args.port)
+    print(f"Mock Groq API at http://{args.host}:{args.port}{CHAT_PATH} (stats at /stats)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+# model_router.py
+
+import random
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+# Assumed latency (seconds) for a model with no samples yet, so untried models get explored
+# once the preferred model gets slower than this
+DEFAULT_LATENCY = 2.0
+
+
+def backoff_delay(retry, base=0.5, cap=8.0):
+    """Exponential backoff with full jitter: a random delay in [0, min(cap, base * 2**retry)]"""
+    return random.uniform(0, min(cap, base * (2 ** retry)))
+
+
+def parse_retry_after(value):
+    """Parse a Retry-After header (seconds or HTTP date) into seconds; None if absent or invalid"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+
+class ModelHealth:
+    """
+    Live health of one model: EWMA latency and success rate, recent latencies for p95,
+    and circuit breaker state ("closed", "open" or "half_open").
+    """
+
+    def __init__(self, name, preference):
+        self.name = name
+        self.preference = preference
+        self.latency_ewma = None
+        self.success_ewma = 1.0
+        self.latencies = deque(maxlen=50)
+        self.calls = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.state = "closed"
+        self.open_until = 0.0
+        self.times_opened = 0
+        self.probe_started = None
+        self.rate_limited_until = 0.0
+
+    def p95(self):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+    def score(self):
+        """Expected cost of routing a call here; lower is better"""
+        latency = DEFAULT_LATENCY if self.latency_ewma is None else (self.latency_ewma + self.p95()) / 2
+        return latency / max(self.success_ewma, 0.05)
+
+    def snapshot(self):
+        p95 = self.p95()
+        return {
+            "model": self.name,
+            "state": self.state,
+            "calls": self.calls,
+            "failures": self.failures,
+            "success_rate": round(self.success_ewma, 3),
+            "latency_ewma": round(self.latency_ewma, 3) if self.latency_ewma is not None else None,
+            "latency_p95": round(p95, 3) if p95 is not None else None,
+        }
+
+
+class ModelRouter:
+    """
+    Chooses the model order for each call from live health.
+    A model whose calls keep failing has its circuit opened and is skipped until a
+    cooldown (doubling on each re-open) elapses; then a single probe call decides
+    whether the circuit closes again.
+    """
+
+    def __init__(self, models, failure_threshold=3, cooldown=30.0, max_cooldown=600.0,
+                 alpha=0.3, min_read_timeout=10.0, max_read_timeout=45.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.alpha = alpha
+        self.min_read_timeout = min_read_timeout
+        self.max_read_timeout = max_read_timeout
+        self._health = {name: ModelHealth(name, i) for i, name in enumerate(models)}
+        self._lock = threading.Lock()
+
+    def order(self):
+        """Return the models worth trying right now, healthiest first"""
+        now = time.time()
+        with self._lock:
+            candidates = []
+            for health in self._health.values():
+                if health.state == "open" and now < health.open_until:
+                    continue
+                # Rate-limited models go last rather than being dropped
+                limited = now < health.rate_limited_until
+                candidates.append((limited, health.score(), health.preference, health.name))
+        candidates.sort()
+        return [name for _, _, _, name in candidates]
+
+    def allow(self, model):
+        """
+        Check whether a call may go to this model now.
+        A model past its cooldown admits one probe call at a time.
+        """
+        now = time.time()
+        with self._lock:
+            health = self._health[model]
+            if health.state == "closed":
+                return True
+            if health.state == "open":
+                if now < health.open_until:
+                    return False
+                health.state = "half_open"
+                health.probe_started = now
+                return True
+            # Half-open: a stuck probe (caller gave up without reporting) is replaced after a timeout
+            if health.probe_started is None or now - health.probe_started > self.max_read_timeout:
+                health.probe_started = now
+                return True
+            return False
+
+    def read_timeout(self, model):
+        """Read timeout for a call: a multiple of the model's observed p95, within fixed bounds"""
+        with self._lock:
+            health = self._health[model]
+            if len(health.latencies) < 5:
+                return self.max_read_timeout
+            p95 = health.p95()
+        return min(self.max_read_timeout, max(self.min_read_timeout, 3 * p95))
+
+    def record_success(self, model, latency=None):
+        with self._lock:
+            health = self._health[model]
+            health.calls += 1
+            health.consecutive_failures = 0
+            health.success_ewma += self.alpha * (1.0 - health.success_ewma)
+            if latency is not None:
+                health.latencies.append(latency)
+                if health.latency_ewma is None:
+                    health.latency_ewma = latency
+                else:
+                    health.latency_ewma += self.alpha * (latency - health.latency_ewma)
+            if health.state != "closed":
+                health.state = "closed"
+                health.times_opened = 0
+                health.probe_started = None
+
+    def record_failure(self, model):
+        with self._lock:
+            health = self._health[model]
+            health.calls += 1
+            health.failures += 1
+            health.consecutive_failures += 1
+            health.success_ewma -= self.alpha * health.success_ewma
+            if health.state == "half_open" or (
+                    health.state == "closed" and health.consecutive_failures >= self.failure_threshold):
+                self._open(health)
+
+    def record_rate_limit(self, model, retry_after):
+        """A 429 is not a model fault; only deprioritize the model until Retry-After passes"""
+        with self._lock:
+            health = self._health[model]
+            health.rate_limited_until = max(health.rate_limited_until, time.time() + (retry_after or 0))
+            if health.state == "half_open":
+                health.probe_started = None
+
+    def _open(self, health):
+        health.times_opened += 1
+        cooldown = min(self.max_cooldown, self.cooldown * (2 ** (health.times_opened - 1)))
+        # Jitter so a fleet of processes does not probe a recovering model in lockstep
+        health.open_until = time.time() + cooldown * random.uniform(0.8, 1.2)
+        health.state = "open"
+        health.probe_started = None
+
+    def snapshot(self):
+        with self._lock:
+            return [health.snapshot() for health in self._health.values()]
@@ -0,0 +1,120 @@
+# normalize.py
+
+import os
+import re
+from collections import Counter
+from context_packer import count_tokens
+
+NORMALIZE_TEXT = os.getenv("NORMALIZE_TEXT", "1") != "0"
+
+# Running headers and footers live in the first/last few lines of a page
+EDGE_LINES = 3
+# A line repeated at the edges of this share of pages (and at least MIN_REPEAT_PAGES) is boilerplate
+REPEAT_SHARE = 0.4
+MIN_REPEAT_PAGES = 3
+
+_DIGITS = re.compile(r"\d+")
+_LETTER = re.compile(r"[^\W\d_]")
+_SPACES = re.compile(r"[^\S\n]+")
+_BLANK_LINES = re.compile(r"\n{3,}")
+# "12", "- 12 -", "Page 12", "12 of 30", "12/30"; at most 3 digits, so a year such as "2021" is kept
+_PAGE_NUMBER = re.compile(r"^(?:page\s*)?[-–—]?\s*\d{1,3}\s*(?:(?:of|/)\s*\d{1,3})?\s*[-–—]?$", re.IGNORECASE)
+# A word broken across lines: "exam-\nple"
+_HYPHENATED = re.compile(r"(\w+)-\n[^\S\n]*(\w+)")
+# Adjacent parts of hyphenated words within a line ("state-of-the-art": state-of, of-the, the-art)
+_HYPHEN_PAIR = re.compile(r"(\w+)-(?=(\w+))")
+
+
+def _line_key(line):
+    """
+    Lines that differ only in numbers (page numbers, dates) count as the same line. Lines
+    without letters get no key: bare numbers are left to _PAGE_NUMBER, so a year is not
+    taken for a page number.
+    """
+    if not _LETTER.search(line):
+        return ""
+    return _DIGITS.sub("#", _SPACES.sub(" ", line.strip().lower()))
+
+
+def _hyphenated_words(pages):
+    """Lowercased "first-second" pairs written with a hyphen somewhere in the text"""
+    return {f"{first}-{second}".lower() for page in pages for first, second in _HYPHEN_PAIR.findall(page)}
+
+
+def _dehyphenate(text, hyphenated):
+    """
+    Rejoin words broken across lines ("exam-\nple"). Breaks are left alone when the next part
+    does not start lowercase ("Jean-\nPaul") or the text writes the word with a hyphen
+    elsewhere ("self-\naware" next to "self-aware"). Returns (text, number of words rejoined).
+    """
+    joins = 0
+
+    def join(match):
+        nonlocal joins
+        first, second = match.groups()
+        if not (_LETTER.match(first[-1]) and second[0].islower()) or f"{first}-{second}".lower() in hyphenated:
+            return match.group()
+        joins += 1
+        return first + second
+
+    return _HYPHENATED.sub(join, text), joins
+
+
+def _edge_lines(lines):
+    """Indexes of the first and last EDGE_LINES non-blank lines of a page"""
+    content = [i for i, line in enumerate(lines) if line.strip()]
+    return content[:EDGE_LINES] + content[-EDGE_LINES:]
+
+
+def normalize_pages(pages):
+    """
+    Clean extracted page texts before they are joined and prompted:
+    - drop running headers/footers (lines repeated at the edges of many pages, ignoring numbers)
+      and bare page numbers at page edges
+    - rejoin words hyphenated across line breaks, unless the text hyphenates them elsewhere
+    - collapse runs of spaces and of blank lines
+    Returns (pages, stats) where stats counts the characters, lines and estimated tokens removed.
+    """
+    split_pages = [page.split("\n") for page in pages]
+    edges = [_edge_lines(lines) for lines in split_pages]
+
+    # Count each line once per page, so a line repeated within one page is not boilerplate
+    repeated = set()
+    if len(pages) >= MIN_REPEAT_PAGES:
+        counts = Counter()
+        for lines, indexes in zip(split_pages, edges):
+            counts.update({_line_key(lines[i]) for i in indexes})
+        threshold = max(MIN_REPEAT_PAGES, REPEAT_SHARE * len(pages))
+        repeated = {key for key, count in counts.items() if count >= threshold and key}
+
+    hyphenated = _hyphenated_words(pages)
+    removed = []
+    dehyphenated = 0
+    result = []
+    for lines, indexes in zip(split_pages, edges):
+        drop = set()
+        if len(pages) > 1:
+            for i in indexes:
+                stripped = lines[i].strip()
+                if _line_key(stripped) in repeated or _PAGE_NUMBER.match(stripped):
+                    drop.add(i)
+                    removed.append(stripped)
+        text = "\n".join(line for i, line in enumerate(lines) if i not in drop)
+        text, joins = _dehyphenate(text, hyphenated)
+        dehyphenated += joins
+        text = _BLANK_LINES.sub("\n\n", "\n".join(line.strip() for line in _SPACES.sub(" ", text).split("\n")))
+        result.append(text.strip())
+
+    chars_before = sum(len(page) for page in pages)
+    chars_after = sum(len(page) for page in result)
+    stats = {
+        "chars_before": chars_before,
+        "chars_after": chars_after,
+        "chars_removed": chars_before - chars_after,
+        "lines_removed": len(removed),
+        "boilerplate_lines": len(repeated),
+        "dehyphenated": dehyphenated,
+        # "exam", "-", "ple" become one piece; whitespace costs no tokens
+        "tokens_removed": (count_tokens("\n".join(removed)) - 1 if removed else 0) + 2 * dehyphenated,
+    }
+    return result, stats
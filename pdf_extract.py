@@ -0,0 +1,108 @@
+# pdf_extract.py
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+import fitz  # PyMuPDF
+
+# Documents with fewer pages than this are extracted in-process
+PARALLEL_PAGE_THRESHOLD = int(os.getenv("PDF_PARALLEL_PAGES", "64"))
+MAX_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(os.cpu_count() or 1)))
+
+# Set once per worker process by _init_worker so the PDF is only shipped (or opened) once
+_worker_document = None
+
+
+def _open(source):
+    """Open a PDF from bytes or from a file path; a path is read lazily by MuPDF"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return fitz.open(stream=source, filetype="pdf")
+    return fitz.open(source, filetype="pdf")
+
+
+def _init_worker(source):
+    global _worker_document
+    _worker_document = _open(source)
+
+
+def _extract_range(start, stop):
+    """Extract pages [start, stop) inside a worker process"""
+    return [_worker_document[page_num].get_text() for page_num in range(start, stop)]
+
+
+def _page_ranges(page_count, parts):
+    """Split range(page_count) into contiguous, roughly equal ranges"""
+    size = max(1, -(-page_count // parts))
+    return [(start, min(start + size, page_count)) for start in range(0, page_count, size)]
+
+
+def _iter_pages_serial(pdf_document):
+    for page_num in range(pdf_document.page_count):
+        yield pdf_document[page_num].get_text()
+
+
+def iter_pages(source, workers=None):
+    """
+    Yield the text of each page of a PDF given as bytes or a file path, in order.
+    Large documents fan page ranges out to a process pool; results are still yielded in page order.
+    Workers given a path open the file themselves instead of receiving a copy of the bytes.
+    """
+    workers = MAX_WORKERS if workers is None else workers
+    pdf_document = _open(source)
+    page_count = pdf_document.page_count
+
+    if page_count < PARALLEL_PAGE_THRESHOLD or workers <= 1:
+        try:
+            yield from _iter_pages_serial(pdf_document)
+        finally:
+            pdf_document.close()
+        return
+
+    pdf_document.close()
+    # A few ranges per worker keeps the pool busy when some pages are much heavier than others
+    ranges = _page_ranges(page_count, workers * 4)
+    try:
+        pool = ProcessPoolExecutor(max_workers=min(workers, len(ranges)),
+                                   initializer=_init_worker, initargs=(source,))
+    except (OSError, NotImplementedError):
+        # Process pools are unavailable on some hosts, fall back to a single core
+        pdf_document = _open(source)
+        try:
+            yield from _iter_pages_serial(pdf_document)
+        finally:
+            pdf_document.close()
+        return
+
+    with pool:
+        futures = [pool.submit(_extract_range, start, stop) for start, stop in ranges]
+        try:
+            for future in futures:
+                yield from future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+class ExtractedDocument:
+    """
+    Extracted text with per-page access.
+    page_offsets[i] is the character offset of page i inside text.
+    """
+
+    def __init__(self, pages):
+        pages = list(pages)
+
+        # Join once instead of growing a string page by page; the pages are not kept, so the
+        # text is held only once
+        joined = "\n".join(pages)
+        self.text = joined.strip()
+        leading = len(joined) - len(joined.lstrip())
+
+        self.page_offsets = []
+        offset = 0
+        for page in pages:
+            self.page_offsets.append(max(0, offset - leading))
+            offset += len(page) + 1
+
+    @property
+    def page_count(self):
+        return len(self.page_offsets)
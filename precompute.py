@@ -0,0 +1,159 @@
+# precompute.py
+
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+from rate_limiter import PRIORITY_BACKGROUND
+from retrieval import get_index
+from evidence import get_evidence_index
+from groq_api import limiter
+from context_packer import count_tokens, fits_budget
+from utils import generate_summary
+from document_store import store as document_store
+
+PRECOMPUTE_WORKERS = int(os.getenv("PRECOMPUTE_WORKERS", "4"))
+MAX_PIPELINES = int(os.getenv("PRECOMPUTE_MAX_DOCUMENTS", "16"))
+# Documents up to this many tokens are summarized ahead of time, as one call, when quota is spare
+SPECULATIVE_SUMMARY_TOKENS = 4000
+
+# Shared by every session; all LLM work here runs at background priority
+_executor = ThreadPoolExecutor(max_workers=PRECOMPUTE_WORKERS, thread_name_prefix="precompute")
+_pipelines = OrderedDict()
+_lock = threading.Lock()
+
+
+class DocumentPipeline:
+    """
+    Futures for the artifacts computed ahead of time for one document: the local "index" and
+    "evidence_index" (True once built; the indexes live in their modules' bounded caches) and a
+    "summary", which is only made when the document fits one call and the rate limiter has quota
+    to spare (None otherwise). Everything else is generated when the user first asks for it.
+    Shared by every session working on the document; holders counts their PipelineHandles.
+    """
+
+    def __init__(self, doc_key, text, page_offsets=None):
+        self.doc_key = doc_key
+        self.futures = {}
+        self.holders = 0
+        self._cancelled = threading.Event()
+
+        self._submit("index", self._build, get_index, text)
+        self._submit("evidence_index", self._build, get_evidence_index, text, page_offsets)
+        self._submit("summary", self._speculative_summary, text)
+
+        # A finished summary is kept with the document for every session
+        self.futures["summary"].add_done_callback(lambda future: self._store("summary", future))
+
+    def _store(self, name, future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        result = future.result()
+        if isinstance(result, str) and result and not result.startswith("Error"):
+            document_store.set_artifact(self.doc_key, name, result)
+
+    @staticmethod
+    def _speculative_summary(text):
+        # Never queue for quota: an upload must not delay what the user asks for next
+        if not fits_budget(text, SPECULATIVE_SUMMARY_TOKENS):
+            return None
+        if not limiter.has_spare(count_tokens(text) + 400):
+            return None
+        return generate_summary(text, priority=PRIORITY_BACKGROUND)
+
+    def _submit(self, name, fn, *args, **kwargs):
+        def run():
+            if self._cancelled.is_set():
+                raise CancelledError()
+            return fn(*args, **kwargs)
+        self.futures[name] = _executor.submit(run)
+
+    @staticmethod
+    def _build(fn, *args):
+        # Left to fn's cache, which bounds how many indexes are kept; a finished future would pin it
+        fn(*args)
+        return True
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def ready(self, name):
+        """True if the artifact finished successfully"""
+        future = self.futures.get(name)
+        return future is not None and future.done() and not future.cancelled() and future.exception() is None
+
+    def result(self, name, timeout=None):
+        """Wait for an artifact; returns None if it failed, was cancelled or timed out"""
+        future = self.futures.get(name)
+        if future is None:
+            return None
+        try:
+            return future.result(timeout=timeout)
+        except Exception:
+            return None
+
+    def claim(self, name):
+        """
+        Return the future for an artifact the caller is about to need.
+        A task that has not started yet is cancelled and None is returned, so the
+        caller computes it directly (e.g. streamed) instead of waiting in the queue.
+        Tasks other sessions also wait on are never cancelled.
+        """
+        future = self.futures.get(name)
+        if future is None:
+            return None
+        with _lock:
+            if self.holders <= 1 and future.cancel():
+                return None
+        return future
+
+    def cancel(self):
+        """Cancel queued tasks; running tasks stop at their next step boundary"""
+        self._cancelled.set()
+        for future in self.futures.values():
+            future.cancel()
+
+
+class PipelineHandle:
+    """
+    A session's reference to a shared pipeline, with the pipeline's methods. The reference is
+    released by release(), or automatically when the handle is garbage collected with its session.
+    """
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self._finalizer = weakref.finalize(self, _release, pipeline)
+
+    def __getattr__(self, name):
+        return getattr(self.pipeline, name)
+
+    def release(self):
+        self._finalizer()
+
+
+def open_pipeline(doc_key, text, page_offsets=None):
+    """Return a PipelineHandle for a document's running precompute pipeline, starting one if needed"""
+    with _lock:
+        pipeline = _pipelines.get(doc_key)
+        if pipeline is None or pipeline.cancelled:
+            pipeline = DocumentPipeline(doc_key, text, page_offsets)
+            _pipelines[doc_key] = pipeline
+            while len(_pipelines) > MAX_PIPELINES:
+                _, evicted = _pipelines.popitem(last=False)
+                evicted.cancel()
+        _pipelines.move_to_end(doc_key)
+        pipeline.holders += 1
+        return PipelineHandle(pipeline)
+
+
+def _release(pipeline):
+    """Drop a holder; the last one to leave cancels and forgets the pipeline"""
+    with _lock:
+        pipeline.holders -= 1
+        if pipeline.holders > 0:
+            return
+        if _pipelines.get(pipeline.doc_key) is pipeline:
+            del _pipelines[pipeline.doc_key]
+    pipeline.cancel()
@@ -0,0 +1,217 @@
+# question_bank.py
+
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from cache import content_hash
+from groq_api import groq_chat
+from rate_limiter import PRIORITY_NORMAL, PRIORITY_BACKGROUND
+from json_repair import parse_json_array
+from utils import (extract_key_facts, is_valid_question, challenge_me, fill_document, DOCUMENT_SLOT,
+                   JSON_MODE_INSTRUCTION)
+
+QUESTION_BANK_DB = os.getenv("QUESTION_BANK_DB", os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), ".cache", "question_bank.db"))
+
+# Questions generated per bulk request, and the unseen stock below which a refill starts
+BATCH_SIZE = {"mcq": 10, "open": 6}
+LOW_WATER = {"mcq": 4, "open": 2}
+
+# Questions per challenge for each challenge type
+CHALLENGE_MIX = {
+    "mixed": {"mcq": 2, "open": 1},
+    "mcq": {"mcq": 3},
+    "open": {"open": 3},
+}
+
+_conn = None
+_db_lock = threading.Lock()
+_refill_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="question-bank")
+_refilling = set()
+_refill_lock = threading.Lock()
+
+
+def _db():
+    global _conn
+    if _conn is None:
+        os.makedirs(os.path.dirname(os.path.abspath(QUESTION_BANK_DB)), exist_ok=True)
+        conn = sqlite3.connect(QUESTION_BANK_DB, check_same_thread=False)
+        with conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS questions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    doc_key TEXT NOT NULL,
+                    qtype TEXT NOT NULL,
+                    question_hash TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    UNIQUE (doc_key, question_hash)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_questions_doc ON questions (doc_key, qtype)")
+        _conn = conn
+    return _conn
+
+
+def _bulk_prompt(key_facts, qtype, count):
+    if qtype == "mcq":
+        shape = """{
+                "question": "[Specific question using exact facts from document]",
+                "type": "mcq",
+                "options": ["A) [option]", "B) [option]", "C) [option]", "D) [option]"],
+                "correct_answer": "[letter of the correct option]",
+                "explanation": "[Where the document states this]"
+            }"""
+        rules = """Each question MUST reference specific facts, numbers, names or terms from the key facts,
+        be answerable ONLY by someone who read this document, and have one clearly correct answer and three
+        plausible wrong answers. Vary the position of the correct option."""
+    else:
+        shape = """{
+                "question": "[Question asking to explain, analyze or compare specific content from the document]",
+                "type": "open"
+            }"""
+        rules = """Each question MUST reference specific concepts, processes or findings from the document and
+        ask students to explain HOW or WHY, or to analyze relationships, causes and effects described in the text."""
+
+    return f"""
+        You are building a bank of quiz questions for students studying this document.
+        Create {count} different {"multiple choice" if qtype == "mcq" else "open-ended"} questions covering different parts of the document.
+
+        KEY FACTS EXTRACTED:
+        {key_facts}
+
+        DOCUMENT TEXT:
+        {DOCUMENT_SLOT}
+
+        {rules}
+
+        Return ONLY a JSON array of {count} objects in this format:
+        [
+            {shape}
+        ]
+        """
+
+
+def _parse_bulk(response, qtype):
+    """Return the valid questions of the requested type from a bulk response, salvaging malformed JSON"""
+    questions, _ = parse_json_array(response)
+    return [q for q in questions if is_valid_question(q) and q.get("type") == qtype]
+
+
+def _store(doc_key, qtype, questions):
+    """Insert questions, skipping duplicates; returns how many were new"""
+    now = time.time()
+    rows = [
+        (doc_key, qtype, content_hash(" ".join(q["question"].lower().split())), json.dumps(q), now)
+        for q in questions
+    ]
+    with _db_lock:
+        conn = _db()
+        with conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO questions (doc_key, qtype, question_hash, payload, created_at) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            return conn.total_changes - before
+
+
+def fill(doc_key, text, qtype, priority=PRIORITY_NORMAL):
+    """Generate a batch of questions of one type with a single request and add them to the bank"""
+    key_facts = extract_key_facts(text, priority=priority)
+    count = BATCH_SIZE[qtype]
+    max_tokens = 250 * count if qtype == "mcq" else 80 * count + 200
+    prompt = fill_document(_bulk_prompt(key_facts, qtype, count) + JSON_MODE_INSTRUCTION, text, max_tokens)
+    response = groq_chat(prompt, temperature=0.7, max_tokens=max_tokens,
+                         use_cache=False, priority=priority, json_mode=True)
+    if response.startswith("Error:"):
+        return 0
+    return _store(doc_key, qtype, _parse_bulk(response, qtype))
+
+
+def stock(doc_key, qtype, exclude_ids=()):
+    """Return the ids of banked questions of a type not in exclude_ids"""
+    with _db_lock:
+        rows = _db().execute(
+            "SELECT id FROM questions WHERE doc_key = ? AND qtype = ?", (doc_key, qtype)
+        ).fetchall()
+    excluded = set(exclude_ids)
+    return [row[0] for row in rows if row[0] not in excluded]
+
+
+def _load(ids):
+    if not ids:
+        return []
+    with _db_lock:
+        rows = _db().execute(
+            f"SELECT id, payload FROM questions WHERE id IN ({','.join('?' * len(ids))})", list(ids)
+        ).fetchall()
+    payloads = {row[0]: json.loads(row[1]) for row in rows}
+    questions = []
+    for question_id in ids:
+        question = payloads[question_id]
+        question["bank_id"] = question_id
+        questions.append(question)
+    return questions
+
+
+def refill_async(doc_key, text, qtype):
+    """Top up the bank in the background; at most one refill per document and type at a time"""
+    job = (doc_key, qtype)
+    with _refill_lock:
+        if job in _refilling:
+            return
+        _refilling.add(job)
+
+    def run():
+        try:
+            fill(doc_key, text, qtype, priority=PRIORITY_BACKGROUND)
+        except Exception as e:
+            print(f"Question bank refill failed: {e}")
+        finally:
+            with _refill_lock:
+                _refilling.discard(job)
+
+    _refill_executor.submit(run)
+
+
+def ensure_stock(doc_key, text, priority=PRIORITY_BACKGROUND):
+    """Make sure the bank holds enough questions of every type (used on upload)"""
+    for qtype in BATCH_SIZE:
+        if len(stock(doc_key, qtype)) < LOW_WATER[qtype]:
+            fill(doc_key, text, qtype, priority=priority)
+
+
+def draw_challenge(doc_key, text, question_type="mixed", seen_ids=()):
+    """
+    Draw a challenge from the document's question bank without repeating seen_ids.
+    Fills the bank synchronously only when it cannot cover the challenge, and refills
+    it in the background when it runs low. Each question carries its "bank_id".
+    """
+    questions = []
+    for qtype, needed in CHALLENGE_MIX[question_type].items():
+        available = stock(doc_key, qtype, seen_ids)
+        if len(available) < needed:
+            fill(doc_key, text, qtype)
+            available = stock(doc_key, qtype, seen_ids)
+        if len(available) < needed:
+            # Everything has been seen this session; allow repeats rather than fail
+            available = stock(doc_key, qtype)
+
+        chosen = random.sample(available, min(needed, len(available)))
+        questions.extend(_load(chosen))
+
+        if len(available) - len(chosen) < LOW_WATER[qtype]:
+            refill_async(doc_key, text, qtype)
+
+    if len(questions) < 2:
+        # The bank could not be filled (e.g. API unavailable), use the direct generator
+        return challenge_me(text, question_type)
+
+    # Keep MCQs first, as in generated challenges
+    questions.sort(key=lambda q: q.get("type") != "mcq")
+    return questions
@@ -0,0 +1,170 @@
+# rate_limiter.py
+
+import itertools
+import random
+import threading
+import time
+
+# Request priorities, lower is admitted first
+PRIORITY_INTERACTIVE = 0  # chat answers, grading
+PRIORITY_NORMAL = 1       # summaries, question generation
+PRIORITY_BACKGROUND = 2   # prefetch, bulk summarization
+
+# A waiting request gains one priority level per this many seconds, so background work is never starved
+AGING_SECONDS = 10.0
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at rate_per_minute"""
+
+    def __init__(self, rate_per_minute, capacity):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until(self, amount, now, floor=0.0):
+        """
+        Seconds until amount can be taken leaving at least floor in the bucket (0 if available
+        now). Amounts larger than the bucket allows only wait for a full bucket, then take()
+        leaves it in debt.
+        """
+        self._refill(now)
+        needed = min(amount + floor, self.capacity)
+        if self.level >= needed:
+            return 0.0
+        return (needed - self.level) / self.rate
+
+    def take(self, amount, now):
+        self._refill(now)
+        # The full amount is debited; a negative level is debt that must refill before the next admit
+        self.level -= amount
+
+
+class _Ticket:
+    __slots__ = ("priority", "seq", "enqueued", "tokens")
+
+    def __init__(self, priority, seq, tokens):
+        self.priority = priority
+        self.seq = seq
+        self.enqueued = time.monotonic()
+        self.tokens = tokens
+
+    def rank(self, now):
+        return (self.priority - (now - self.enqueued) / AGING_SECONDS, self.seq)
+
+
+class RateLimiter:
+    """
+    Process-wide limiter on requests per minute and tokens per minute.
+    Waiting callers are admitted one at a time by priority (with aging), FIFO within a priority,
+    so requests leave at a smooth rate instead of in bursts.
+    A limit of 0 disables that bucket.
+
+    The token bucket holds a minute of quota, so one typical call (prompt plus max_tokens) fits.
+    interactive_reserve of it is kept for PRIORITY_INTERACTIVE calls: other calls are admitted
+    only if they leave the reserve in the bucket, so they never run it into debt, while an
+    interactive call is admitted as soon as the reserve is there and may overdraw it.
+    """
+
+    def __init__(self, requests_per_minute=30, tokens_per_minute=6000, burst_seconds=3.0, interactive_reserve=0.25):
+        self.requests = None
+        self.tokens = None
+        self.reserve = 0.0
+        if requests_per_minute > 0:
+            self.requests = TokenBucket(requests_per_minute, max(1.0, requests_per_minute / 60.0 * burst_seconds))
+        if tokens_per_minute > 0:
+            self.tokens = TokenBucket(tokens_per_minute, tokens_per_minute)
+            self.reserve = tokens_per_minute * interactive_reserve
+        self.paused_until = 0.0
+        self.admitted = {}
+        self.total_wait = 0.0
+        self._waiting = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def _wait_time(self, ticket, now):
+        wait = self.paused_until - now
+        if self.requests is not None:
+            wait = max(wait, self.requests.time_until(1, now))
+        if self.tokens is not None:
+            if ticket.priority == PRIORITY_INTERACTIVE:
+                wait = max(wait, self.tokens.time_until(min(ticket.tokens, self.reserve), now))
+            else:
+                wait = max(wait, self.tokens.time_until(ticket.tokens, now, floor=self.reserve))
+        return max(0.0, wait)
+
+    def has_spare(self, tokens):
+        """True if nothing is queued and a background call of this many tokens would be admitted now"""
+        with self._cond:
+            if self._waiting:
+                return False
+            return self._wait_time(_Ticket(PRIORITY_BACKGROUND, -1, tokens), time.monotonic()) <= 0
+
+    def acquire(self, tokens=1, priority=PRIORITY_NORMAL, timeout=None):
+        """
+        Block until this call may be sent. Returns False if timeout (seconds) passes first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            ticket = _Ticket(priority, next(self._seq), tokens)
+            self._waiting.append(ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    head = min(self._waiting, key=lambda t: t.rank(now))
+                    wait = None
+                    # The oldest interactive call need not queue behind an aged call waiting for
+                    # quota: it only spends the reserve, which that call cannot use anyway
+                    if head is ticket or (ticket.priority == PRIORITY_INTERACTIVE and ticket is min(
+                            (t for t in self._waiting if t.priority == PRIORITY_INTERACTIVE), key=lambda t: t.seq)):
+                        wait = self._wait_time(ticket, now)
+                        if wait <= 0:
+                            if self.requests is not None:
+                                self.requests.take(1, now)
+                            if self.tokens is not None:
+                                self.tokens.take(tokens, now)
+                            self.admitted[priority] = self.admitted.get(priority, 0) + 1
+                            self.total_wait += now - ticket.enqueued
+                            return True
+                    if deadline is not None:
+                        remaining = deadline - now
+                        if remaining <= 0:
+                            return False
+                        wait = remaining if wait is None else min(wait, remaining)
+                    self._cond.wait(wait)
+            finally:
+                self._waiting.remove(ticket)
+                self._cond.notify_all()
+
+    def record_usage(self, estimated_tokens, actual_tokens):
+        """Reconcile an admitted call's token estimate with the usage the API reported"""
+        if self.tokens is None or actual_tokens is None:
+            return
+        with self._cond:
+            now = time.monotonic()
+            self.tokens._refill(now)
+            self.tokens.level = min(self.tokens.capacity, self.tokens.level - (actual_tokens - estimated_tokens))
+            self._cond.notify_all()
+
+    def penalize(self, seconds):
+        """
+        Pause all admissions after a 429, with jitter so processes do not resume in lockstep
+        """
+        with self._cond:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds * random.uniform(1.0, 1.25))
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            admitted = sum(self.admitted.values())
+            return {
+                "waiting": len(self._waiting),
+                "admitted": dict(self.admitted),
+                "avg_wait": round(self.total_wait / admitted, 3) if admitted else 0.0,
+                "paused_for": round(max(0.0, self.paused_until - time.monotonic()), 3),
+            }
@@ -0,0 +1,135 @@
+# retrieval.py
+
+import os
+import re
+import numpy as np
+from sklearn.feature_extraction.text import CountVectorizer
+from cache import LRUCache, content_hash
+
+CHUNK_CHARS = int(os.getenv("RETRIEVAL_CHUNK_CHARS", "800"))
+
+# BM25 parameters
+K1 = 1.5
+B = 0.75
+
+_SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+|\n\s*\n')
+
+# Built indexes, keyed by document hash
+_index_cache = LRUCache(max_items=int(os.getenv("RETRIEVAL_CACHE_ITEMS", "8")))
+
+
+def chunk_text(text, chunk_chars=CHUNK_CHARS):
+    """
+    Split text into sentence-aligned chunks of roughly chunk_chars characters.
+    Returns a list of (start_offset, chunk) tuples.
+    """
+    chunks = []
+    chunk_start = 0
+    chunk_end = 0
+    position = 0
+
+    for match in _SENTENCE_BOUNDARY.finditer(text):
+        sentence_end = match.start()
+        if sentence_end - chunk_start > chunk_chars and chunk_end > chunk_start:
+            chunks.append((chunk_start, text[chunk_start:chunk_end]))
+            chunk_start = position
+        chunk_end = sentence_end
+        position = match.end()
+
+    if chunk_end > chunk_start and len(text) - chunk_start > chunk_chars:
+        chunks.append((chunk_start, text[chunk_start:chunk_end]))
+        chunk_start = position
+    if text[chunk_start:].strip():
+        chunks.append((chunk_start, text[chunk_start:]))
+
+    # Break up sentence-free runs (tables, code) that are still far too long
+    result = []
+    for start, chunk in chunks:
+        if len(chunk) <= chunk_chars * 2:
+            result.append((start, chunk))
+            continue
+        for offset in range(0, len(chunk), chunk_chars):
+            result.append((start + offset, chunk[offset:offset + chunk_chars]))
+    return result
+
+
+class RetrievalIndex:
+    """
+    BM25 index over document chunks backed by a sparse term matrix.
+    Scoring a question only touches the matrix columns of its terms.
+    """
+
+    def __init__(self, text, chunk_chars=CHUNK_CHARS):
+        chunks = chunk_text(text, chunk_chars)
+        self.offsets = [start for start, _ in chunks]
+        self.chunks = [chunk for _, chunk in chunks]
+        self.vocabulary = {}
+        self.weights = None
+
+        if not self.chunks:
+            return
+
+        vectorizer = CountVectorizer(lowercase=True, stop_words='english', dtype=np.float32)
+        try:
+            counts = vectorizer.fit_transform(self.chunks).tocsr()
+        except ValueError:
+            return  # Only stop words / no tokens, fall back to document order
+
+        self._analyzer = vectorizer.build_analyzer()
+        self.vocabulary = vectorizer.vocabulary_
+
+        n_chunks = counts.shape[0]
+        doc_lengths = np.asarray(counts.sum(axis=1)).ravel()
+        avg_length = doc_lengths.mean() or 1.0
+        doc_freq = np.bincount(counts.indices, minlength=counts.shape[1])
+        idf = np.log(1.0 + (n_chunks - doc_freq + 0.5) / (doc_freq + 0.5)).astype(np.float32)
+
+        # Precompute the full BM25 weight of every (chunk, term) entry
+        rows = np.repeat(np.arange(n_chunks), np.diff(counts.indptr))
+        tf = counts.data
+        norm = K1 * (1.0 - B + B * doc_lengths[rows] / avg_length)
+        counts.data = (tf * (K1 + 1.0) / (tf + norm) * idf[counts.indices]).astype(np.float32)
+        self.weights = counts.tocsc()
+
+    def scores(self, question):
+        """Return a BM25 score per chunk for the question"""
+        scores = np.zeros(len(self.chunks), dtype=np.float32)
+        if self.weights is None:
+            return scores
+        term_ids = sorted({self.vocabulary[t] for t in self._analyzer(question) if t in self.vocabulary})
+        if term_ids:
+            scores = np.asarray(self.weights[:, term_ids].sum(axis=1)).ravel()
+        return scores
+
+    def top_chunks(self, question, k=8):
+        """Return up to k (chunk_index, score) pairs, best first"""
+        scores = self.scores(question)
+        if not len(scores):
+            return []
+        k = min(k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best], kind='stable')]
+        return [(int(i), float(scores[i])) for i in best if scores[i] > 0]
+
+    def central_chunks(self):
+        """
+        All chunk indexes ordered by how representative they are of the whole document:
+        each chunk's BM25 weights against the document's overall term weights. The opening
+        chunk (title, abstract) always comes first.
+        """
+        if self.weights is None:
+            return list(range(len(self.chunks)))
+        importance = np.asarray(self.weights.sum(axis=0)).ravel()
+        scores = np.asarray(self.weights @ importance).ravel()
+        scores[0] = np.inf
+        return [int(i) for i in np.argsort(-scores, kind='stable')]
+
+
+def get_index(text):
+    """Return the RetrievalIndex for a document, building it once per document"""
+    key = content_hash(text)
+    index = _index_cache.get(key)
+    if index is None:
+        index = RetrievalIndex(text)
+        _index_cache.set(key, index)
+    return index
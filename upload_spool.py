@@ -0,0 +1,147 @@
+# upload_spool.py
+
+import codecs
+import hashlib
+import os
+import tempfile
+
+# Uploads at least this large are extracted from a temp file instead of from bytes in memory
+LARGE_UPLOAD_BYTES = int(os.getenv("LARGE_UPLOAD_MB", "16")) * 1024 * 1024
+CHUNK_BYTES = 1024 * 1024
+SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR") or None  # None: the system temp directory
+
+# Bytes of a text file looked at to guess its encoding
+ENCODING_SAMPLE_BYTES = 64 * 1024
+MIN_DETECTION_BYTES = 256
+
+_BOMS = (
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+
+
+def upload_size(uploaded_file):
+    """Size in bytes of an upload, without reading it when the size is known"""
+    size = getattr(uploaded_file, "size", None)
+    if size is not None:
+        return size
+    path = getattr(uploaded_file, "path", None)
+    if path is not None:
+        return os.path.getsize(path)
+    return len(uploaded_file.getvalue())
+
+
+def iter_upload(uploaded_file, chunk_bytes=CHUNK_BYTES):
+    """Yield an upload's bytes in chunks from the start, without copying the whole upload"""
+    path = getattr(uploaded_file, "path", None)
+    if path is not None:
+        with open(path, "rb") as f:
+            while chunk := f.read(chunk_bytes):
+                yield chunk
+        return
+    if hasattr(uploaded_file, "seek") and hasattr(uploaded_file, "read"):
+        uploaded_file.seek(0)
+        try:
+            while chunk := uploaded_file.read(chunk_bytes):
+                yield chunk
+        finally:
+            uploaded_file.seek(0)
+        return
+    data = memoryview(uploaded_file.getvalue())
+    for start in range(0, len(data), chunk_bytes):
+        yield data[start:start + chunk_bytes]
+
+
+def upload_digest(uploaded_file):
+    """SHA-256 hex digest of an upload, computed chunk by chunk (same as cache.content_hash of its bytes)"""
+    digest = hashlib.sha256()
+    for chunk in iter_upload(uploaded_file):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+class SpooledUpload:
+    """
+    An upload on disk, for code that reads files by path. Uploads that already are files
+    (they have a .path) are used in place; others are streamed to a temp file that is
+    removed on close.
+
+        with SpooledUpload(uploaded_file) as spooled:
+            pages = iter_pages(spooled.path)
+    """
+
+    def __init__(self, uploaded_file):
+        self.path = getattr(uploaded_file, "path", None)
+        self._temporary = self.path is None
+        if self._temporary:
+            fd, self.path = tempfile.mkstemp(prefix="upload-", dir=SPOOL_DIR)
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    for chunk in iter_upload(uploaded_file):
+                        f.write(chunk)
+            except BaseException:
+                os.remove(self.path)
+                raise
+
+    def close(self):
+        if self._temporary and self.path is not None:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+            self.path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def detect_encoding(sample, complete=False):
+    """
+    Guess the encoding of text from its first bytes (complete: the sample is the whole file):
+    a byte order mark, else UTF-8 if the sample is valid UTF-8, else a charset_normalizer
+    guess, else cp1252.
+    """
+    for bom, encoding in _BOMS:
+        if sample.startswith(bom):
+            return encoding
+    try:
+        # A sample cut from a longer file may end in the middle of a character
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=complete)
+        return "utf-8"
+    except UnicodeDecodeError:
+        pass
+    if len(sample) < MIN_DETECTION_BYTES:
+        return "cp1252"  # Too little text for a statistical guess
+    try:
+        from charset_normalizer import from_bytes
+    except ImportError:
+        return "cp1252"
+    candidates = [match.encoding for match in from_bytes(sample)]
+    # Mostly-ASCII Western text fits several code pages equally well; prefer the common one
+    if not candidates or "cp1252" in candidates:
+        return "cp1252"
+    return candidates[0]
+
+
+def decode_file(path, encoding=None, chunk_bytes=CHUNK_BYTES):
+    """
+    Decode a text file chunk by chunk, so the raw bytes are never held next to the text.
+    Undecodable bytes become U+FFFD. Returns (text, encoding).
+    """
+    with open(path, "rb") as f:
+        if encoding is None:
+            sample = f.read(ENCODING_SAMPLE_BYTES)
+            encoding = detect_encoding(sample, complete=len(sample) < ENCODING_SAMPLE_BYTES)
+            f.seek(0)
+        decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        pieces = []
+        while chunk := f.read(chunk_bytes):
+            pieces.append(decoder.decode(chunk))
+        pieces.append(decoder.decode(b"", final=True))
+    return "".join(pieces), encoding
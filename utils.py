@@ -1,46 +1,178 @@
 # utils.py
 
 import os
-import fitz  # PyMuPDF
-from groq_api import groq_chat
+from groq_api import groq_chat, groq_chat_stream, groq_chat_many, MODELS, SYSTEM_PROMPT
+from cache import LRUCache, DiskCache, TieredCache, content_hash
+from pdf_extract import ExtractedDocument, iter_pages
+from retrieval import chunk_text
+from evidence import locate_quotes
+from context_packer import fits_budget, input_budget, pack_context
+from rate_limiter import PRIORITY_INTERACTIVE, PRIORITY_NORMAL
+from json_repair import IncrementalArrayParser, parse_json_array, record_path
+from metrics import span, registry
+from normalize import NORMALIZE_TEXT, normalize_pages
+from document_store import store as document_store
+from upload_spool import (LARGE_UPLOAD_BYTES, ENCODING_SAMPLE_BYTES, SpooledUpload, upload_size, upload_digest,
+                          detect_encoding, decode_file)
 import json
 
+# Extraction cache: identical uploads are parsed once per process and survive restarts
+_CACHE_DIR = os.getenv("EXTRACTION_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "extraction"))
+_extraction_cache = TieredCache(
+    LRUCache(max_items=int(os.getenv("EXTRACTION_CACHE_ITEMS", "16"))),
+    DiskCache(_CACHE_DIR, max_bytes=int(os.getenv("EXTRACTION_CACHE_MAX_MB", "256")) * 1024 * 1024)
+)
+
+# Map-reduce summarization: long documents are summarized section by section, then condensed
+SUMMARY_CHUNK_CHARS = int(os.getenv("SUMMARY_CHUNK_CHARS", "6000"))
+SUMMARY_PARALLELISM = int(os.getenv("SUMMARY_PARALLELISM", "4"))
+_section_summary_cache = TieredCache(
+    LRUCache(max_items=512),
+    DiskCache(os.path.join(os.path.dirname(_CACHE_DIR), "section_summaries"), max_bytes=64 * 1024 * 1024)
+)
+
+# Placeholder for the document in prompt templates, filled by fill_document within the token budget
+DOCUMENT_SLOT = "<<DOCUMENT>>"
+
+# JSON mode responses must be a single object, so generation prompts ask for the array under a key
+JSON_MODE_INSTRUCTION = """
+        Wrap the array in a JSON object under the key "questions": {"questions": [...]}
+        """
+
+def get_extraction_cache_stats():
+    """Return hit/miss counters for the memory and disk extraction cache tiers"""
+    return _extraction_cache.stats()
+
+def _read_upload(uploaded_file):
+    """Return the full upload bytes without depending on the current read position"""
+    if hasattr(uploaded_file, "getvalue"):
+        return uploaded_file.getvalue()
+    return uploaded_file.read()
+
+def _extract_uncached(file_bytes, file_type):
+    """Parse the upload bytes into a list of page texts; raises on malformed input"""
+    if file_type == "application/pdf":
+        return list(iter_pages(file_bytes))
+    
+    # TXT files are treated as a single page
+    encoding = detect_encoding(file_bytes[:ENCODING_SAMPLE_BYTES], complete=len(file_bytes) <= ENCODING_SAMPLE_BYTES)
+    return [file_bytes.decode(encoding, errors="replace")]
+
+def _upload_key(digest, file_type):
+    # Normalized and raw extractions of the same file are cached apart
+    return f"{digest}-{'pdf' if file_type == 'application/pdf' else 'txt'}-{'normalized' if NORMALIZE_TEXT else 'pages'}"
+
+def _normalize(pages):
+    """Strip boilerplate from freshly extracted pages (see normalize.py), recording what was removed"""
+    if not NORMALIZE_TEXT:
+        return pages
+    with span("normalize", pages=len(pages)) as stage:
+        pages, stats = normalize_pages(pages)
+        stage.set(**stats)
+    registry.inc("normalized_chars_removed_total", stats["chars_removed"])
+    registry.inc("normalized_tokens_removed_total", stats["tokens_removed"])
+    return pages
+
+def _iter_json_pages(pages, chunk_chars=1024 * 1024):
+    """json.dumps(pages) in pieces; long pages are escaped slice by slice rather than copied whole"""
+    yield "["
+    for i, page in enumerate(pages):
+        yield ', "' if i else '"'
+        for start in range(0, len(page), chunk_chars):
+            yield json.dumps(page[start:start + chunk_chars])[1:-1]
+        yield '"'
+    yield "]"
+
+def _extract_large(uploaded_file, size, stage, cache_key=None):
+    """
+    Large-document mode: the upload is streamed to a temp file and parsed from there, so its
+    bytes are never held whole next to the text. The result bypasses the in-memory cache tier.
+    """
+    if cache_key is None:
+        cache_key = _upload_key(upload_digest(uploaded_file), uploaded_file.type)
+    cached = _extraction_cache.disk.get(cache_key)
+    if cached is not None:
+        stage.set(cache="hit", bytes=size, mode="large")
+        return ExtractedDocument(json.loads(cached))
+    
+    with SpooledUpload(uploaded_file) as spooled:
+        if uploaded_file.type == "application/pdf":
+            pages = list(iter_pages(spooled.path))
+        else:
+            pages = [decode_file(spooled.path)[0]]
+    pages = _normalize(pages)
+    _extraction_cache.disk.set_stream(cache_key, _iter_json_pages(pages))
+    stage.set(cache="miss", bytes=size, pages=len(pages), mode="large")
+    return ExtractedDocument(pages)
+
+def extract_document(uploaded_file, upload_key=None):
+    """
+    Extract an uploaded PDF or TXT file into an ExtractedDocument (text plus per-page offsets).
+    upload_key is the cache key from _upload_key if the caller already hashed the upload.
+    Raises ValueError for unsupported file types.
+    """
+    if uploaded_file.type not in ("application/pdf", "text/plain"):
+        raise ValueError("Unsupported file type. Please upload PDF or TXT files.")
+    
+    with span("extraction", file_type=uploaded_file.type) as stage:
+        size = upload_size(uploaded_file)
+        if size >= LARGE_UPLOAD_BYTES:
+            return _extract_large(uploaded_file, size, stage, upload_key)
+        
+        file_bytes = _read_upload(uploaded_file)
+        
+        # Cache key is the content hash, so re-uploads under another name still hit
+        cache_key = upload_key or _upload_key(content_hash(file_bytes), uploaded_file.type)
+        cached = _extraction_cache.get(cache_key)
+        if cached is not None:
+            stage.set(cache="hit", bytes=len(file_bytes))
+            return ExtractedDocument(json.loads(cached))
+        
+        pages = _normalize(_extract_uncached(file_bytes, uploaded_file.type))
+        _extraction_cache.set(cache_key, json.dumps(pages))
+        stage.set(cache="miss", bytes=len(file_bytes), pages=len(pages))
+        return ExtractedDocument(pages)
+
+def open_document(uploaded_file):
+    """
+    Return a DocumentHandle for an upload from the shared document store, extracting it only
+    if no session has uploaded the same bytes yet. Raises like extract_document.
+    """
+    # Hashed once here: a large upload is read end to end for it
+    upload_key = _upload_key(upload_digest(uploaded_file), uploaded_file.type)
+    handle = document_store.open_upload(upload_key)
+    if handle is not None:
+        return handle
+    document = extract_document(uploaded_file, upload_key)
+    return document_store.add_and_open(document.text, document.page_offsets, upload_key)
+
 def extract_text(uploaded_file):
     """
     Extract text from uploaded PDF or TXT file
     """
     try:
-        if uploaded_file.type == "application/pdf":
-            # Extract text from PDF
-            pdf_bytes = uploaded_file.read()
-            pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
-            
-            text = ""
-            for page_num in range(pdf_document.page_count):
-                page = pdf_document[page_num]
-                text += page.get_text() + "\n"
-            
-            pdf_document.close()
-            return text.strip()
-            
-        elif uploaded_file.type == "text/plain":
-            # Extract text from TXT file
-            return uploaded_file.read().decode('utf-8')
-        else:
+        if uploaded_file.type not in ("application/pdf", "text/plain"):
             return "Unsupported file type. Please upload PDF or TXT files."
-            
+        return extract_document(uploaded_file).text
     except Exception as e:
         return f"Error extracting text: {str(e)}"
 
-def generate_summary(text):
+def fill_document(prompt, text, max_tokens, query=None):
     """
-    Generate a summary of the document (≤150 words)
+    Replace DOCUMENT_SLOT in prompt with as much of the document as every fallback model can take
+    next to the rest of the prompt and max_tokens of output. When the document does not fit, the
+    sentences most relevant to query (or most central to the document) are kept.
+    """
+    budget = input_budget(SYSTEM_PROMPT + prompt, max_tokens, MODELS)
+    return prompt.replace(DOCUMENT_SLOT, pack_context(text, budget, query=query))
+
+def generate_summary(text, stream=False, map_reduce=True, parallelism=None, priority=PRIORITY_NORMAL):
+    """
+    Generate a summary of the document (≤150 words).
+    With stream=True, returns a generator of text pieces instead of the full string.
+    Documents over the context budget are condensed with map_reduce_summary first;
+    map_reduce=False keeps the most central sentences instead.
     """
-    # Limit text length to avoid token limits
-    max_length = 3000
-    if len(text) > max_length:
-        text = text[:max_length] + "..."
-    
     prompt = f"""
     Please provide a concise summary of the following document in exactly 150 words or less. 
     Focus on the main points, key arguments, and important conclusions.
@@ -49,28 +181,118 @@ def generate_summary(text):
     Respond in plain text format (NOT JSON). Write a clear, readable summary.
 
     Document:
-    {text}
+    {DOCUMENT_SLOT}
 
     Summary (150 words max):
     """
     
-    return groq_chat(prompt, temperature=0.3, max_tokens=200)
+    budget = input_budget(SYSTEM_PROMPT + prompt, 200, MODELS)
+    if map_reduce and not fits_budget(text, budget):
+        text = map_reduce_summary(text, max_tokens=budget, parallelism=parallelism, priority=priority)
+    prompt = fill_document(prompt, text, 200)
+    
+    if stream:
+        return groq_chat_stream(prompt, temperature=0.3, max_tokens=200, priority=priority)
+    return groq_chat(prompt, temperature=0.3, max_tokens=200, priority=priority)
+
+def _summarize_sections(sections, parallelism, priority=PRIORITY_NORMAL):
+    """
+    Summarize sections concurrently (at most parallelism calls in flight) at the caller's priority.
+    Section summaries are cached by content hash, so re-runs and overlapping documents reuse them.
+    """
+    keys = [content_hash(section) for section in sections]
+    summaries = [_section_summary_cache.get(key) for key in keys]
+    missing = [i for i, summary in enumerate(summaries) if summary is None]
+    
+    responses = groq_chat_many([
+        {"prompt": f"""
+    Summarize the following part of a longer document in about 120 words.
+    Keep the key facts, numbers, names, arguments and conclusions. Respond in plain text.
+
+    Text:
+    {sections[i]}
+
+    Summary:
+    """, "temperature": 0.3, "max_tokens": 250, "priority": priority}
+        for i in missing
+    ], max_concurrency=parallelism)
+    
+    for i, response in zip(missing, responses):
+        if response.startswith("Error:"):
+            continue  # Leave the section out rather than feed an error into the summary
+        _section_summary_cache.set(keys[i], response)
+        summaries[i] = response
+    
+    return [summary for summary in summaries if summary]
 
-def ask_anything(text, question):
+def _group_sections(summaries, max_chars):
+    """Group consecutive summaries into sections of at most max_chars (at least two per group)"""
+    groups = []
+    current = []
+    size = 0
+    for summary in summaries:
+        if current and size + len(summary) > max_chars and len(current) >= 2:
+            groups.append("\n\n".join(current))
+            current = []
+            size = 0
+        current.append(summary)
+        size += len(summary) + 2
+    if current:
+        groups.append("\n\n".join(current))
+    return groups
+
+def map_reduce_summary(text, max_tokens=1000, parallelism=None, priority=PRIORITY_NORMAL):
     """
-    Answer any question about the document with justification and relevant snippets
+    Condense a long document to at most max_tokens tokens of section summaries.
+    Sections are summarized concurrently, then the summaries are merged level by level,
+    so the number of sequential rounds grows with the log of the document size.
     """
-    # Limit text length
-    max_length = 2500
-    if len(text) > max_length:
-        text = text[:max_length] + "..."
+    parallelism = parallelism or SUMMARY_PARALLELISM
+    with span("map_reduce", document_chars=len(text)) as stage:
+        sections = [chunk for _, chunk in chunk_text(text, SUMMARY_CHUNK_CHARS)]
+        summaries = _summarize_sections(sections, parallelism, priority)
+        
+        rounds = 1
+        while len(summaries) > 1 and not fits_budget("\n\n".join(summaries), max_tokens):
+            summaries = _summarize_sections(_group_sections(summaries, SUMMARY_CHUNK_CHARS), parallelism, priority)
+            rounds += 1
+        stage.set(sections=len(sections), rounds=rounds)
+    
+    condensed = "\n\n".join(summaries)
+    if not condensed:
+        # Every section call failed; fall back to the most central sentences of the document
+        return pack_context(text, max_tokens)
+    return pack_context(condensed, max_tokens)
+
+def _remember(tokens, memory, question):
+    """Pass a token stream through and record the exchange in memory once it completes"""
+    pieces = []
+    for piece in tokens:
+        pieces.append(piece)
+        yield piece
+    answer = "".join(pieces)
+    if answer.strip() and not answer.startswith("Error:"):
+        memory.add_turn(question, answer)
+
+def ask_anything(text, question, stream=False, memory=None):
+    """
+    Answer any question about the document with justification and relevant snippets.
+    With stream=True, returns a token generator instead; once the stream is consumed,
+    pass the full response and the document to extract_supporting_evidence.
+    Pass a ConversationMemory to answer follow-up questions; the exchange is added to it.
+    """
+    history = memory.render() if memory is not None else ""
+    conversation = f"""
+    Conversation so far (use it to understand follow-up questions; answer from the document):
+    {history}
+""" if history else ""
     
     prompt = f"""
     Based on the following document, please answer the question clearly and provide justification for your answer.
 
     Document:
-    {text}
-
+    {DOCUMENT_SLOT}
+    {conversation}
     Question: {question}
 
     Please provide a clear, natural text response (NOT JSON format) that includes:
@@ -86,10 +308,22 @@ def ask_anything(text, question):
     **Supporting Evidence:** "[Quote exact text from document that supports this answer]"
     """
     
+    # Fill the context budget with the chunks most relevant to the question
+    query = memory.retrieval_query(question) if memory is not None else question
+    with span("retrieval", document_chars=len(text), memory_chars=len(history)):
+        prompt = fill_document(prompt, text, 400, query=query)
+    
+    if stream:
+        tokens = groq_chat_stream(prompt, temperature=0.2, max_tokens=400, priority=PRIORITY_INTERACTIVE)
+        return _remember(tokens, memory, question) if memory is not None else tokens
+    
     try:
-        response = groq_chat(prompt, temperature=0.2, max_tokens=400)
+        response = groq_chat(prompt, temperature=0.2, max_tokens=400, priority=PRIORITY_INTERACTIVE)
+        if memory is not None and not response.startswith("Error:"):
+            memory.add_turn(question, response)
         
         # Extract supporting evidence for highlighting
+        # Quotes are located in the whole document, not just the retrieved context
         supporting_text = extract_supporting_evidence(response, text)
         
         return response, supporting_text
@@ -98,38 +332,20 @@ def ask_anything(text, question):
         error_response = f"Error processing question: {str(e)}"
         return error_response, []
 
-def extract_supporting_evidence(response, original_text):
+def extract_supporting_evidence(response, original_text, page_offsets=None):
     """
-    Extract quoted text from the response that can be highlighted in the original document
+    Locate the passages quoted in the response within the original document.
+    Matching tolerates case, whitespace, punctuation and hyphenation differences and small wording
+    changes. Returns up to 3 dicts with "text" (as it appears in the document), "start"/"end"
+    character offsets and "page" (1-based, or None without page_offsets).
     """
     try:
-        import re
-        
-        # Look for text in quotes in the response
-        quoted_patterns = [
-            r'"([^"]+)"',  # Text in double quotes
-            r"'([^']+)'",  # Text in single quotes
-            r'Supporting Evidence.*?["\']([^"\']+)["\']',  # Text after "Supporting Evidence"
-        ]
-        
-        supporting_snippets = []
-        
-        for pattern in quoted_patterns:
-            try:
-                matches = re.findall(pattern, response, re.IGNORECASE | re.DOTALL)
-                for match in matches:
-                    # Clean up the match
-                    clean_match = match.strip()
-                    if len(clean_match) > 10 and clean_match.lower() in original_text.lower():
-                        supporting_snippets.append(clean_match)
-            except Exception:
-                continue  # Skip this pattern if it fails
-        
-        return supporting_snippets[:3]  # Limit to 3 snippets max
+        with span("evidence"):
+            return locate_quotes(response, original_text, page_offsets=page_offsets)
     except Exception:
         return []  # Return empty list if anything fails
 
-def extract_key_facts(text):
+def extract_key_facts(text, priority=PRIORITY_NORMAL):
     """Extract specific facts, numbers, names, and concepts from the document"""
     
     # First, let's extract key information using AI
@@ -145,7 +361,7 @@ def extract_key_facts(text):
     6. Cause-and-effect relationships mentioned
     
     Document:
-    {text[:3000]}  # Use first part for extraction
+    {DOCUMENT_SLOT}
     
     Return the information in this format:
     NUMBERS/DATES: [list specific numbers, dates, percentages found]
@@ -157,21 +373,87 @@ def extract_key_facts(text):
     """
     
     try:
-        extraction = groq_chat(extract_prompt, temperature=0.1, max_tokens=800)
+        extraction = groq_chat(fill_document(extract_prompt, text, 800), temperature=0.1, max_tokens=800,
+                               priority=priority)
         return extraction
     except:
         return "Could not extract key facts"
 
-def challenge_me(text, question_type="mixed"):
+def is_valid_question(q):
+    """Check that a generated question is specific and well-formed"""
+    if not isinstance(q, dict):
+        return False
+    if not (q.get('question') and q.get('type') and 
+            len(q['question']) > 20 and
+            not any(generic in q['question'].lower() for generic in ['generic', 'general', 'typical', 'common'])):
+        return False
+    
+    # Additional validation for MCQ questions
+    if q['type'] == 'mcq':
+        return bool(q.get('options') and len(q['options']) == 4 and 
+                    q.get('correct_answer') and q.get('explanation'))
+    return True  # open questions
+
+def parse_questions(response, attempt=1):
+    """
+    Parse and validate a question-generation response, repairing slightly malformed JSON.
+    Returns up to 3 valid questions, or None if the response is unusable.
+    """
+    questions, path = parse_json_array(response)
+    valid_questions = [q for q in questions if is_valid_question(q)]
+    
+    if len(valid_questions) >= 2:  # Accept if at least 2 good questions
+        return valid_questions[:3]
+    print(f"Attempt {attempt} failed: {path} parse, {len(valid_questions)} valid questions")
+    return None
+
+def _stream_questions(prompt, priority):
+    """
+    Stream a question generation, validating each question as soon as it is complete.
+    Stops reading once 3 valid questions have arrived. Returns (valid_questions, raw_response).
+    Streams cannot use JSON mode, so the JSON shape is only asked for in the prompt.
+    """
+    parser = IncrementalArrayParser()
+    valid_questions = []
+    pieces = []
+    stream = groq_chat_stream(prompt + JSON_MODE_INSTRUCTION, temperature=0.3, max_tokens=1200,
+                              use_cache=False, priority=priority)
+    try:
+        for piece in stream:
+            pieces.append(piece)
+            valid_questions.extend(q for q in parser.feed(piece) if is_valid_question(q))
+            if len(valid_questions) >= 3:
+                break
+    finally:
+        stream.close()
+    
+    if len(valid_questions) < 3:
+        # Salvage a truncated or slightly malformed tail
+        valid_questions.extend(q for q in parser.finish() if is_valid_question(q))
+    return valid_questions[:3], "".join(pieces)
+
+def _repair_questions(raw_response, priority):
+    """Ask the model to fix its own malformed JSON; far cheaper than regenerating from the document"""
+    prompt = f"""
+    The following output was supposed to be a JSON array of quiz question objects but it is malformed or incomplete.
+    Fix it so it is valid JSON. Keep the questions, options and answers exactly as written; drop any
+    question that is cut off. Return the array wrapped in a JSON object: {{"questions": [...]}}
+
+    Output to fix:
+    {raw_response}
+    """
+    response = groq_chat(prompt, temperature=0, max_tokens=1200, use_cache=False, priority=priority, json_mode=True)
+    if response.startswith("Error:"):
+        return None
+    return parse_questions(response, attempt="repair")
+
+def challenge_me(text, question_type="mixed", priority=PRIORITY_NORMAL):
     """
     Generate 3 high-quality challenge questions from the document
     question_type: "mcq", "open", or "mixed"
     """
     # First extract key facts from the document
-    key_facts = extract_key_facts(text)
-    
-    # Use a smaller, focused portion of text for question generation
-    focused_text = text[:4000] if len(text) > 4000 else text
+    key_facts = extract_key_facts(text, priority=priority)
     
     if question_type == "mcq":
         prompt = f"""
@@ -181,7 +463,7 @@ def challenge_me(text, question_type="mixed"):
         {key_facts}
 
         DOCUMENT TEXT:
-        {focused_text}
+        {DOCUMENT_SLOT}
 
         Create 3 MCQ questions that test specific knowledge from this document. Each question MUST:
         1. Reference specific facts, numbers, names, or terms from the extracted key facts
@@ -227,7 +509,7 @@ def challenge_me(text, question_type="mixed"):
         {key_facts}
 
         DOCUMENT TEXT:
-        {focused_text}
+        {DOCUMENT_SLOT}
 
         Create questions that:
         1. Reference specific concepts, processes, or findings from the document
@@ -264,7 +546,7 @@ def challenge_me(text, question_type="mixed"):
         {key_facts}
 
         DOCUMENT TEXT:
-        {focused_text}
+        {DOCUMENT_SLOT}
 
         REQUIREMENTS:
         - Questions 1 & 2: "type": "mcq" with 4 options each, testing specific facts
@@ -294,52 +576,37 @@ def challenge_me(text, question_type="mixed"):
             }}
         ]
         """
+    prompt = fill_document(prompt, text, 1200)
+    
+    # Bypass the response cache so every new challenge (and retry) samples fresh questions
+    questions, raw_response = _stream_questions(prompt, priority)
+    if len(questions) >= 2:
+        record_path("streamed")
+        return questions
+    
+    # A malformed answer usually only needs its JSON fixed, not a full regeneration
+    if raw_response.strip() and not raw_response.startswith("Error:"):
+        questions = _repair_questions(raw_response, priority)
+        if questions:
+            record_path("repair_call")
+            return questions
     
-    # Try multiple times with different approaches
-    for attempt in range(3):
-        try:
-            response = groq_chat(prompt, temperature=0.3 + (attempt * 0.2), max_tokens=1200)
-            
-            # Clean the response to extract JSON
-            response = response.strip()
-            if '```json' in response:
-                response = response.split('```json')[1].split('```')[0]
-            elif '```' in response:
-                response = response.split('```')[1].split('```')[0]
-            
-            # Try to find JSON in the response
-            import re
-            json_match = re.search(r'\[.*\]', response, re.DOTALL)
-            if json_match:
-                response = json_match.group()
-            
-            questions = json.loads(response)
-            
-            if isinstance(questions, list) and len(questions) >= 3:
-                # Validate questions are specific and well-formed
-                valid_questions = []
-                for q in questions[:3]:
-                    if (q.get('question') and q.get('type') and 
-                        len(q['question']) > 20 and
-                        not any(generic in q['question'].lower() for generic in ['generic', 'general', 'typical', 'common'])):
-                        
-                        # Additional validation for MCQ questions
-                        if q['type'] == 'mcq':
-                            if (q.get('options') and len(q['options']) == 4 and 
-                                q.get('correct_answer') and q.get('explanation')):
-                                valid_questions.append(q)
-                        else:  # open questions
-                            valid_questions.append(q)
-                
-                if len(valid_questions) >= 2:  # Accept if at least 2 good questions
-                    return valid_questions[:3]
-                    
-        except Exception as e:
-            print(f"Attempt {attempt + 1} failed: {e}")
-            continue
+    # Retries are independent samples at higher temperatures, so run them concurrently
+    # and keep the first usable set instead of paying for them one after another
+    retries = groq_chat_many([
+        {"prompt": prompt + JSON_MODE_INSTRUCTION, "temperature": 0.3 + (attempt * 0.2), "max_tokens": 1200,
+         "use_cache": False, "priority": priority, "json_mode": True}
+        for attempt in (1, 2)
+    ])
+    for attempt, response in enumerate(retries, 2):
+        questions = parse_questions(response, attempt=attempt)
+        if questions:
+            record_path("regenerated")
+            return questions
     
+    record_path("manual_fallback")
     # If all attempts fail, create manual questions based on document content
-    return create_manual_questions(focused_text, question_type)
+    return create_manual_questions(text, question_type)
 
 def create_manual_questions(text, question_type):
     """Create questions manually by analyzing document content"""